@@ -0,0 +1,258 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from db_utils import get_db_connection, get_index_version
+from chroma_utils import embedding_function
+
+# ── Configuration ────────────────────────────────────────────────────
+# ANSWER_CACHE_BACKEND: "off", "memory" or "sqlite" (persisted in rag_app.db)
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "off").lower()
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# ── Storage backends ─────────────────────────────────────────────────
+# The similarity search always runs over an in-memory matrix; a backend
+# only decides where entries are persisted so they can be reloaded.
+class MemoryCacheBackend:
+    def load(self) -> list:
+        return []
+
+    def save(self, entry: dict):
+        pass
+
+    def touch(self, key: str, last_used: float):
+        pass
+
+    def delete(self, keys: list):
+        pass
+
+    def clear(self):
+        pass
+
+class SQLiteCacheBackend:
+    def __init__(self):
+        conn = get_db_connection()
+        conn.execute('''CREATE TABLE IF NOT EXISTS answer_cache
+                        (key TEXT PRIMARY KEY,
+                         question TEXT,
+                         history TEXT,
+                         embedding BLOB,
+                         answer TEXT,
+                         index_version INTEGER,
+                         created_at REAL,
+                         last_used REAL)''')
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(answer_cache)')}
+        if 'history' not in columns:
+            # Entries written before answers were scoped to their history may
+            # come from any session, so they are dropped rather than shared
+            conn.execute('DELETE FROM answer_cache')
+            conn.execute('ALTER TABLE answer_cache ADD COLUMN history TEXT')
+        conn.commit()
+        conn.close()
+
+    def load(self) -> list:
+        conn = get_db_connection()
+        rows = conn.execute('SELECT * FROM answer_cache ORDER BY last_used').fetchall()
+        conn.close()
+        return [{
+            "key": row['key'],
+            "question": row['question'],
+            "history": row['history'],
+            "embedding": np.frombuffer(row['embedding'], dtype=np.float32),
+            "answer": row['answer'],
+            "index_version": row['index_version'],
+            "created_at": row['created_at'],
+            "last_used": row['last_used'],
+        } for row in rows]
+
+    def save(self, entry: dict):
+        conn = get_db_connection()
+        conn.execute('''INSERT OR REPLACE INTO answer_cache
+                        (key, question, history, embedding, answer, index_version, created_at, last_used)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (entry["key"], entry["question"], entry["history"], entry["embedding"].tobytes(),
+                      entry["answer"], entry["index_version"], entry["created_at"], entry["last_used"]))
+        conn.commit()
+        conn.close()
+
+    def touch(self, key: str, last_used: float):
+        conn = get_db_connection()
+        conn.execute('UPDATE answer_cache SET last_used = ? WHERE key = ?', (last_used, key))
+        conn.commit()
+        conn.close()
+
+    def delete(self, keys: list):
+        if not keys:
+            return
+        conn = get_db_connection()
+        conn.executemany('DELETE FROM answer_cache WHERE key = ?', [(k,) for k in keys])
+        conn.commit()
+        conn.close()
+
+    def clear(self):
+        conn = get_db_connection()
+        conn.execute('DELETE FROM answer_cache')
+        conn.commit()
+        conn.close()
+
+# ── Semantic cache ───────────────────────────────────────────────────
+class SemanticAnswerCache:
+    """
+    Answers keyed by the embedding of the standalone question and the
+    fingerprint of the history it was answered against.
+
+    A lookup returns the stored answer of the most similar question asked
+    against the same history when the cosine similarity reaches `threshold`,
+    so an answer drawn from one session's conversation is never served to
+    another. Entries expire after `ttl` seconds,
+    the least recently used entry is evicted beyond `max_entries`, and the
+    whole cache is dropped when the Chroma index version changes.
+    """
+
+    def __init__(self, backend, threshold: float, ttl: float, max_entries: int):
+        self.backend = backend
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._histories = None
+        self._index_version = get_index_version()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0,
+                       "evictions": 0, "expirations": 0, "invalidations": 0}
+
+        stale = []
+        for entry in backend.load():
+            if entry["index_version"] == self._index_version:
+                self._entries[entry["key"]] = entry
+            else:
+                stale.append(entry["key"])
+        backend.delete(stale)
+
+    def _rebuild_matrix(self):
+        self._keys = list(self._entries)
+        self._matrix = (np.vstack([self._entries[k]["embedding"] for k in self._keys])
+                        if self._keys else None)
+        self._histories = np.array([self._entries[k]["history"] for k in self._keys], dtype=object)
+
+    def _invalidate_if_stale(self):
+        version = get_index_version()
+        if version != self._index_version:
+            self._index_version = version
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._matrix = None
+            self.backend.clear()
+
+    def _expire(self, now: float):
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._stats["expirations"] += len(expired)
+            self._matrix = None
+            self.backend.delete(expired)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, history: str) -> Optional[dict]:
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._invalidate_if_stale()
+            self._expire(now)
+            if not self._entries:
+                self._stats["misses"] += 1
+                return None
+            if self._matrix is None:
+                self._rebuild_matrix()
+
+            scores = np.where(self._histories == history, self._matrix @ query, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self._stats["misses"] += 1
+                return None
+
+            key = self._keys[best]
+            entry = self._entries[key]
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        self.backend.touch(key, now)
+        return {**entry, "similarity": float(scores[best])}
+
+    def store(self, question: str, history: str, embedding, answer: str):
+        now = time.time()
+        entry = {
+            "key": uuid.uuid4().hex,
+            "question": question,
+            "history": history,
+            "embedding": self._normalize(embedding),
+            "answer": answer,
+            "created_at": now,
+            "last_used": now,
+        }
+        with self._lock:
+            self._invalidate_if_stale()
+            entry["index_version"] = self._index_version
+            evicted = []
+            while len(self._entries) >= self.max_entries:
+                key, _ = self._entries.popitem(last=False)
+                evicted.append(key)
+            self._entries[entry["key"]] = entry
+            self._matrix = None
+            self._stats["stores"] += 1
+            self._stats["evictions"] += len(evicted)
+        self.backend.delete(evicted)
+        self.backend.save(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "backend": type(self.backend).__name__,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "index_version": self._index_version,
+                "threshold": self.threshold,
+            }
+
+def create_answer_cache() -> Optional[SemanticAnswerCache]:
+    if ANSWER_CACHE_BACKEND == "off":
+        return None
+    backend = SQLiteCacheBackend() if ANSWER_CACHE_BACKEND == "sqlite" else MemoryCacheBackend()
+    return SemanticAnswerCache(backend, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES)
+
+answer_cache = create_answer_cache()
+
+# ── Async helpers used by main.py ────────────────────────────────────
+async def alookup_answer(question: str, history: str):
+    """Return (cached entry or None, question embedding) for `question` asked against `history`."""
+    if answer_cache is None:
+        return None, None
+    embedding = await embedding_function.aembed_query(question)
+    entry = await asyncio.to_thread(answer_cache.lookup, embedding, history)
+    return entry, embedding
+
+async def astore_answer(question: str, history: str, embedding, answer: str, route: str | None):
+    # "end" answers come straight from the conversation, not from the documents
+    if answer_cache is None or embedding is None or route == "end":
+        return
+    await asyncio.to_thread(answer_cache.store, question, history, embedding, answer)
+
+def answer_cache_stats() -> dict:
+    return answer_cache.stats() if answer_cache else {"backend": "off"}
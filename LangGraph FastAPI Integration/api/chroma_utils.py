@@ -1,19 +1,90 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from typing import List
+from typing import Callable, Iterator, List, Optional
 from langchain_core.documents import Document
+from embedding_cache import CachedEmbeddings
+from collections import defaultdict
+from functools import lru_cache
+import hashlib
 import os
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
+from db_utils import bump_index_version
+from parallel_loader import use_parallel_loader, iter_pdf_split_batches
+from metrics import span
+from http_clients import openai_client_kwargs
+from startup import Lazy
 
 load_dotenv(override=True)
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-embedding_function = OpenAIEmbeddings()
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+# ── Vector store backend ─────────────────────────────────────────────
+# "embedded" opens the index in-process under CHROMA_PERSIST_DIR, so only
+# one API process may use it; "http" talks to a Chroma server
+# (`chroma run --path ./chroma_db --port 8001`) that every API worker and
+# host shares
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded").lower()
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() == "true"
+CHROMA_AUTH_TOKEN = os.getenv("CHROMA_AUTH_TOKEN")
+# Keep-alive pool of the HTTP client, shared by every thread of the process
+CHROMA_HTTP_MAX_CONNECTIONS = int(os.getenv("CHROMA_HTTP_MAX_CONNECTIONS", "20"))
+CHROMA_HTTP_KEEPALIVE = float(os.getenv("CHROMA_HTTP_KEEPALIVE", "40"))
 
-def load_and_split_document(file_path: str) -> List[Document]:
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+
+def build_embeddings():
+    # langchain_openai and chromadb are slow to import; keep them off the import path
+    from langchain_openai import OpenAIEmbeddings
+    return CachedEmbeddings(OpenAIEmbeddings(**openai_client_kwargs()))
+
+def chroma_http_client():
+    """Client of the Chroma server; its connection pool is reused by every call of this process."""
+    import chromadb
+    from chromadb.config import Settings
+    settings = Settings(anonymized_telemetry=False,
+                        chroma_http_max_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                        chroma_http_max_keepalive_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                        chroma_http_keepalive_secs=CHROMA_HTTP_KEEPALIVE)
+    headers = {"Authorization": f"Bearer {CHROMA_AUTH_TOKEN}"} if CHROMA_AUTH_TOKEN else None
+    return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL, headers=headers, settings=settings)
+
+def build_chroma_client():
+    import chromadb
+    if CHROMA_MODE == "http":
+        return chroma_http_client()
+    return chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+
+def build_vectorstore():
+    from langchain_chroma import Chroma
+    return Chroma(client=chroma_client.instance(), collection_name=CHROMA_COLLECTION,
+                  embedding_function=embedding_function.instance())
+
+# Built on first use (or by the start-up warm-up, see startup.py).
+# Chunk embeddings go through a persistent content-addressed cache.
+embedding_function = Lazy("embeddings", build_embeddings)
+chroma_client = Lazy("chroma_client", build_chroma_client)
+vectorstore = Lazy("chroma", build_vectorstore)
+
+@lru_cache(maxsize=1)
+def collection_space() -> str:
+    """Distance function of the collection: "l2" (Chroma's default), "cosine" or "ip"."""
+    # Building the vectorstore creates the collection if it does not exist yet
+    vectorstore.instance()
+    configuration = chroma_client.get_collection(CHROMA_COLLECTION).configuration
+    index = configuration.get("hnsw") or configuration.get("spann") or {}
+    return index.get("space") or "l2"
+
+# Number of chunks embedded and written to Chroma per batch
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+def load_document(file_path: str) -> List[Document]:
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
     if file_path.endswith('.pdf'):
         loader = PyPDFLoader(file_path)
     elif file_path.endswith('.docx'):
@@ -22,20 +93,94 @@ def load_and_split_document(file_path: str) -> List[Document]:
         loader = UnstructuredHTMLLoader(file_path)
     else:
         raise ValueError(f"Unsupported file type: {file_path}")
-    
-    documents = loader.load()
-    return text_splitter.split_documents(documents)
+
+    return loader.load()
+
+def load_and_split_document(file_path: str) -> List[Document]:
+    return text_splitter.split_documents(load_document(file_path))
+
+def iter_document_splits(file_path: str, timings: Optional[dict] = None) -> Iterator[List[Document]]:
+    """
+    Yield the splits of a document in batches, in page order.
+
+    Large PDFs are parsed and split page-parallel in a process pool (see
+    parallel_loader.py) and yield one batch per page range; everything else
+    goes through the single-process loader and yields a single batch.
+    `timings` records the seconds spent in `load`/`split`, or in
+    `load_split` for the parallel path.
+    """
+    timings = timings if timings is not None else {}
+    if use_parallel_loader(file_path):
+        timings.setdefault("load_split", 0.0)
+        batches = iter_pdf_split_batches(file_path, CHUNK_SIZE, CHUNK_OVERLAP)
+        while True:
+            t0 = time.perf_counter()
+            batch = next(batches, None)
+            timings["load_split"] += time.perf_counter() - t0
+            if batch is None:
+                return
+            yield batch
+    else:
+        t0 = time.perf_counter()
+        documents = load_document(file_path)
+        t1 = time.perf_counter()
+        splits = text_splitter.split_documents(documents)
+        timings["load"] = t1 - t0
+        timings["split"] = time.perf_counter() - t1
+        yield splits
+
+def chunk_hash(text: str) -> str:
+    """Content hash stored as `chunk_hash` metadata; /update-doc matches chunks on it."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def add_splits_to_chroma(splits: List[Document], file_id: int,
+                         on_progress: Optional[Callable[[int], None]] = None,
+                         timings: Optional[dict] = None):
+    """
+    Embed and add splits in batches of INDEX_BATCH_SIZE.
+
+    `on_progress` receives the number of chunks stored so far and `timings`
+    accumulates the seconds spent in the `embed` and `add` stages.
+
+    Chunks are searchable as soon as their batch is added, before the
+    document is marked ready: retrieval may already cite a file that is
+    still indexing (or whose indexing later fails and is rolled back),
+    while /list-docs only shows it once it is ready.
+    """
+    timings = timings if timings is not None else {}
+    timings.setdefault("embed", 0.0)
+    timings.setdefault("add", 0.0)
+
+    # Add metadata to each split
+    for split in splits:
+        split.metadata['file_id'] = file_id
+        split.metadata['chunk_hash'] = chunk_hash(split.page_content)
+
+    for start in range(0, len(splits), INDEX_BATCH_SIZE):
+        batch = splits[start:start + INDEX_BATCH_SIZE]
+        texts = [d.page_content for d in batch]
+
+        t0 = time.perf_counter()
+        # Fills the embedding cache, so add_texts below reads the vectors
+        # back from it instead of calling the model again
+        embedding_function.embed_documents(texts)
+        t1 = time.perf_counter()
+        with span("chroma", "add"):
+            vectorstore.add_texts(texts, metadatas=[d.metadata for d in batch],
+                                  ids=[str(uuid.uuid4()) for _ in batch])
+        t2 = time.perf_counter()
+
+        timings["embed"] += t1 - t0
+        timings["add"] += t2 - t1
+        if on_progress:
+            on_progress(start + len(batch))
 
 def index_document_to_chroma(file_path: str, file_id: int) -> bool:
     try:
-        splits = load_and_split_document(file_path)
-        
-        # Add metadata to each split
-        for split in splits:
-            split.metadata['file_id'] = file_id
-        
-        vectorstore.add_documents(splits)
+        for splits in iter_document_splits(file_path):
+            add_splits_to_chroma(splits, file_id)
         # vectorstore.persist()
+        bump_index_version()
         return True
     except Exception as e:
         print(f"Error indexing document: {e}")
@@ -43,16 +188,79 @@ def index_document_to_chroma(file_path: str, file_id: int) -> bool:
 
 def delete_doc_from_chroma(file_id: int):
     try:
-        docs = vectorstore.get(where={"file_id": file_id})
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+        # Ids only; the chunk texts and metadata are not needed to count them
+        chunks = count_doc_chunks(file_id)
+        print(f"Found {chunks} document chunks for file_id {file_id}")
         
-        if docs['ids']:
+        if chunks:
             # Delete the documents with the specified file_id
-            vectorstore.delete(ids=docs['ids'])
-            print(f"Deleted {len(docs['ids'])} document chunks with file_id {file_id}")
+            with span("chroma", "delete"):
+                vectorstore.delete(where={"file_id": file_id})
+            print(f"Deleted {chunks} document chunks with file_id {file_id}")
+            bump_index_version()
         else:
             print(f"No document chunks found with file_id {file_id}")
         return True
     except Exception as e:
         print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
         return False
+
+def delete_docs_from_chroma(file_ids: List[int]) -> bool:
+    """Delete the chunks of every file in `file_ids` with one `where` filter, without reading them."""
+    try:
+        with span("chroma", "delete"):
+            vectorstore.delete(where={"file_id": {"$in": list(file_ids)}})
+        print(f"Deleted the document chunks of file_ids {list(file_ids)}")
+        bump_index_version()
+        return True
+    except Exception as e:
+        print(f"Error deleting documents with file_ids {list(file_ids)} from Chroma: {str(e)}")
+        return False
+
+def count_doc_chunks(file_id: int) -> int:
+    with span("chroma", "get"):
+        return len(vectorstore.get(where={"file_id": file_id}, include=[])['ids'])
+
+# One update at a time per document, so two new versions cannot interleave
+_update_locks = defaultdict(threading.Lock)
+
+def update_doc_in_chroma(file_path: str, file_id: int, timings: Optional[dict] = None) -> dict:
+    """
+    Sync the chunks of `file_id` with a new version of the document.
+
+    The new version is re-split and each chunk matched by hash against the
+    stored ones (chunks indexed before `chunk_hash` existed are hashed from
+    their stored text). Matches are kept as they are; only new chunks are
+    embedded and added, then the vanished ones are deleted, so a failure
+    half-way never leaves the document with missing chunks.
+    Returns the `kept`, `added` and `removed` chunk counts.
+    """
+    with _update_locks[file_id]:
+        with span("chroma", "get"):
+            stored = vectorstore.get(where={"file_id": file_id}, include=["documents", "metadatas"])
+        # chunk hash -> ids of the stored chunks with that text
+        unmatched = defaultdict(list)
+        for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+            unmatched[(metadata or {}).get('chunk_hash') or chunk_hash(text)].append(chunk_id)
+
+        kept = added = 0
+        for splits in iter_document_splits(file_path, timings):
+            new_splits = []
+            for split in splits:
+                ids = unmatched.get(chunk_hash(split.page_content))
+                if ids:
+                    ids.pop()
+                    kept += 1
+                else:
+                    new_splits.append(split)
+            if new_splits:
+                add_splits_to_chroma(new_splits, file_id, timings=timings)
+                added += len(new_splits)
+
+        vanished = [chunk_id for ids in unmatched.values() for chunk_id in ids]
+        if vanished:
+            with span("chroma", "delete"):
+                vectorstore.delete(ids=vanished)
+        if added or vanished:
+            bump_index_version()
+        return {"kept": kept, "added": added, "removed": len(vanished)}
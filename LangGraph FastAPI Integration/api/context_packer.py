@@ -0,0 +1,181 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+import tiktoken
+from langchain_core.documents import Document
+
+# ── Configuration ────────────────────────────────────────────────────
+# Tokens of retrieved context (chunks and web snippets) sent to the answer LLM
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Shingle containment at or above which a passage counts as a near-duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Shortest shared span (characters) trimmed as chunk overlap
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", "40"))
+# A passage that does not fit is cut to the remaining budget only if at
+# least this many tokens are left; otherwise it is dropped
+CONTEXT_MIN_PASSAGE_TOKENS = 50
+SHINGLE_WORDS = 3
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text or ""))
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    return get_encoding().decode(get_encoding().encode(text)[:tokens])
+
+def words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+@dataclass
+class Passage:
+    text: str
+    source: str = "rag"
+    # Retrieval relevance when known, comparable only within one source;
+    # passages without a score keep the order they were given in
+    score: Optional[float] = None
+    metadata: dict = field(default_factory=dict)
+
+@dataclass
+class PackResult:
+    passages: List[Passage]
+    tokens_in: int
+    tokens_out: int
+    duplicates_dropped: int = 0
+    overlap_chars_removed: int = 0
+    over_budget: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def text(self, source: str) -> str:
+        return "\n\n".join(p.text for p in self.passages if p.source == source)
+
+    def summary(self) -> dict:
+        return {"tokens_in": self.tokens_in, "tokens_out": self.tokens_out, "tokens_saved": self.tokens_saved,
+                "duplicates_dropped": self.duplicates_dropped,
+                "overlap_chars_removed": self.overlap_chars_removed, "over_budget": self.over_budget}
+
+# ── Overlap and near-duplicates ──────────────────────────────────────
+def overlap_length(head: str, tail: str, min_chars: int = CONTEXT_MIN_OVERLAP) -> int:
+    """Length of the longest suffix of `head` that is also a prefix of `tail` (0 if shorter than min_chars)."""
+    probe = tail[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    start = head.find(probe, max(len(head) - len(tail), 0))
+    while start != -1:
+        if tail.startswith(head[start:]):
+            return len(head) - start
+        start = head.find(probe, start + 1)
+    return 0
+
+def shingles(text: str) -> set:
+    tokens = words(text)
+    if len(tokens) <= SHINGLE_WORDS:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + SHINGLE_WORDS]) for i in range(len(tokens) - SHINGLE_WORDS + 1)}
+
+def containment(a: set, b: set) -> float:
+    """Share of the smaller shingle set found in the other one."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+def rank_passages(passages: Sequence[Passage]) -> List[Passage]:
+    """
+    Order passages for packing. Scores of different sources (Chroma
+    relevance, a search engine's ranking) are not on one scale, so each
+    source is ranked on its own, by score when all its passages have one and
+    otherwise in the order given, and the sources then take turns.
+    """
+    by_source = {}
+    for passage in passages:
+        by_source.setdefault(passage.source, []).append(passage)
+    groups = []
+    for group in by_source.values():
+        if all(p.score is not None for p in group):
+            # sorted() is stable, so equal scores keep the retrieval order
+            group = sorted(group, key=lambda p: -p.score)
+        groups.append(group)
+    ranked = []
+    for rank in range(max(map(len, groups), default=0)):
+        ranked += [group[rank] for group in groups if rank < len(group)]
+    return ranked
+
+# ── Packing ──────────────────────────────────────────────────────────
+_totals_lock = threading.Lock()
+_totals = {"requests": 0, "tokens_in": 0, "tokens_out": 0, "duplicates_dropped": 0,
+           "overlap_chars_removed": 0, "over_budget": 0}
+
+def pack_context(passages: Sequence[Passage], budget: int = CONTEXT_TOKEN_BUDGET) -> PackResult:
+    """
+    Pack `passages` into `budget` tokens in `rank_passages` order: spans shared
+    with an already kept passage (the chunk splitter's overlap) are trimmed,
+    near-duplicates are dropped and the rest is added until the budget is
+    used up. Kept passages come back in rank order.
+    """
+    passages = [p for p in passages if p.text and p.text.strip()]
+    tokens_in = sum(count_tokens(p.text) for p in passages)
+    ranked = rank_passages(passages)
+
+    kept: List[Tuple[Passage, set]] = []
+    result = PackResult([], tokens_in, 0)
+    used = 0
+    for passage in ranked:
+        text = passage.text
+        marks = shingles(text)
+        if any(containment(marks, other) >= CONTEXT_DEDUP_THRESHOLD for _, other in kept):
+            result.duplicates_dropped += 1
+            continue
+        for other, _ in kept:
+            head = overlap_length(other.text, text)
+            if head:
+                text = text[head:].lstrip()
+            tail = overlap_length(text, other.text)
+            if tail:
+                text = text[:-tail].rstrip()
+        result.overlap_chars_removed += len(passage.text) - len(text)
+        if len(text) < CONTEXT_MIN_OVERLAP:
+            result.duplicates_dropped += 1
+            continue
+
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            result.over_budget += 1
+            if budget - used < CONTEXT_MIN_PASSAGE_TOKENS:
+                continue
+            text = truncate_tokens(text, budget - used)
+            tokens = count_tokens(text)
+        packed = Passage(text, passage.source, passage.score, passage.metadata)
+        kept.append((packed, shingles(text)))
+        used += tokens
+
+    result.passages = [p for p, _ in kept]
+    result.tokens_out = used
+    with _totals_lock:
+        _totals["requests"] += 1
+        for key, value in result.summary().items():
+            if key in _totals:
+                _totals[key] += value
+    return result
+
+def pack_documents(docs: Sequence[Document],
+                   budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Document], PackResult]:
+    """
+    `pack_context` for retriever output; scores are read from metadata["score"]
+    when present, otherwise the retriever's order is kept.
+    """
+    result = pack_context([Passage(d.page_content, "rag", d.metadata.get("score"), d.metadata)
+                                     for d in docs], budget)
+    return [Document(page_content=p.text, metadata=p.metadata) for p in result.passages], result
+
+def packer_stats() -> dict:
+    with _totals_lock:
+        return {**_totals, "tokens_saved": _totals["tokens_in"] - _totals["tokens_out"],
+                "budget": CONTEXT_TOKEN_BUDGET}
@@ -1,12 +1,138 @@
 import sqlite3
-from datetime import datetime
+import asyncio
+import base64
+import json
+import os
+import queue
+import re
+import time
+from datetime import datetime, timezone
+from write_behind import WriteBehindWriter
 
 DB_NAME = "rag_app.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# Batch chat history inserts in a background writer instead of one commit per request
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "true").lower() == "true"
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "200"))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "0.05"))
+
+# Applied to every new connection. WAL lets readers run concurrently with
+# the single writer, and synchronous=NORMAL is safe under WAL while
+# avoiding an fsync per commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+)
+
+# Called as query_observer(statement, seconds) after every statement run
+# through a pooled connection or its cursors; set by metrics.py
+query_observer = None
+
+def set_query_observer(observer):
+    global query_observer
+    query_observer = observer
+
+def observed(method, statement, *args):
+    if query_observer is None:
+        return method(statement, *args)
+    t0 = time.perf_counter()
+    try:
+        return method(statement, *args)
+    finally:
+        query_observer(statement, time.perf_counter() - t0)
+
+class ObservedCursor:
+    """sqlite3 cursor proxy reporting statement timings to `query_observer`."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, statement, *args):
+        observed(self._cursor.execute, statement, *args)
+        return self
+
+    def executemany(self, statement, *args):
+        observed(self._cursor.executemany, statement, *args)
+        return self
+
+class PooledConnection:
+    """sqlite3 connection proxy whose close() hands the connection back to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, statement, *args):
+        return observed(self._conn.execute, statement, *args)
+
+    def executemany(self, statement, *args):
+        return observed(self._conn.executemany, statement, *args)
+
+    def cursor(self):
+        return ObservedCursor(self._conn.cursor())
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Thread-safe pool of up to `size` idle connections to one database file."""
+
+    def __init__(self, db_name, size):
+        self.db_name = db_name
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+pool = ConnectionPool(DB_NAME, DB_POOL_SIZE)
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection; call close() to return it."""
+    return pool.acquire()
 
 def create_chat_history():
     conn = get_db_connection()
@@ -19,42 +145,152 @@ def create_chat_history():
                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
     conn.close()
 
-def insert_chat_history(session_id, user_query, gpt_response, model):
+def write_chat_history_rows(rows):
+    """Insert (session_id, user_query, gpt_response, model, created_at) rows in one transaction."""
     conn = get_db_connection()
-    conn.execute('INSERT INTO chat_history (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
-                 (session_id, user_query, gpt_response, model))
-    conn.commit()
-    conn.close()
+    try:
+        conn.executemany('INSERT INTO chat_history (session_id, user_query, gpt_response, model, created_at) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def insert_chat_history(session_id, user_query, gpt_response, model):
+    # created_at is taken now, not when a batched row is finally written
+    row = (session_id, user_query, gpt_response, model, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    if chat_history_writer:
+        chat_history_writer.enqueue(row)
+    else:
+        write_chat_history_rows([row])
+
+def read_session_rows(session_id, read_committed):
+    """Committed rows plus the session's rows still waiting in the write-behind queue."""
+    if chat_history_writer:
+        return chat_history_writer.read_consistent(session_id, read_committed)
+    return read_committed(), []
 
 def get_chat_history(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_query, gpt_response FROM chat_history WHERE session_id = ? ORDER BY created_at', (session_id,))
+    def read_committed():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_query, gpt_response FROM chat_history WHERE session_id = ? ORDER BY created_at, id', (session_id,))
+        rows = [(row['user_query'], row['gpt_response']) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    rows, pending = read_session_rows(session_id, read_committed)
     messages = []
-    for row in cursor.fetchall():
+    for user_query, gpt_response in rows + [(row[1], row[2]) for row in pending]:
         messages.extend([
-            {"role": "human", "content": row['user_query']},
-            {"role": "ai", "content": row['gpt_response']}
+            {"role": "human", "content": user_query},
+            {"role": "ai", "content": gpt_response}
         ])
-    conn.close()
     return messages
 
+def get_chat_turns(session_id, after_id=0, limit=None):
+    """
+    Return the session's turns with id > after_id, newest first. Turns
+    still in the write-behind queue come first and have id None.
+    """
+    def read_committed():
+        conn = get_db_connection()
+        rows = conn.execute('SELECT id, user_query, gpt_response FROM chat_history WHERE session_id = ? AND id > ? '
+                            'ORDER BY created_at DESC, id DESC LIMIT ?',
+                            (session_id, after_id, -1 if limit is None else limit)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    rows, pending = read_session_rows(session_id, read_committed)
+    turns = [{"id": None, "user_query": row[1], "gpt_response": row[2]} for row in reversed(pending)] + rows
+    return turns if limit is None else turns[:limit]
+
+def create_session_summaries():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS session_summaries
+                    (session_id TEXT PRIMARY KEY,
+                     summary TEXT,
+                     summarized_until INTEGER,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.close()
+
+def get_session_summary(session_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT summary, summarized_until FROM session_summaries WHERE session_id = ?',
+                       (session_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else {"summary": "", "summarized_until": 0}
+
+def upsert_session_summary(session_id, summary, summarized_until):
+    conn = get_db_connection()
+    conn.execute('''INSERT INTO session_summaries (session_id, summary, summarized_until) VALUES (?, ?, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary,
+                        summarized_until = excluded.summarized_until, updated_at = CURRENT_TIMESTAMP''',
+                 (session_id, summary, summarized_until))
+    conn.commit()
+    conn.close()
+
+def add_column_if_missing(conn, table, column, definition):
+    columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
 def create_document_store():
     conn = get_db_connection()
     conn.execute('''CREATE TABLE IF NOT EXISTS document_store
                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
                      filename TEXT,
                      upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    # 'pending' rows are still being indexed and are hidden from listings
+    add_column_if_missing(conn, 'document_store', 'status', "TEXT DEFAULT 'ready'")
+    # SHA-256 of the uploaded bytes; unique so the same file is indexed only once
+    add_column_if_missing(conn, 'document_store', 'content_hash', "TEXT")
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_document_store_content_hash
+                    ON document_store (content_hash) WHERE content_hash IS NOT NULL''')
+    conn.commit()
     conn.close()
 
-def insert_document_record(filename):
+def insert_document_record(filename, status='ready', content_hash=None):
+    """Insert a document row; raises sqlite3.IntegrityError if `content_hash` is already stored."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-    file_id = cursor.lastrowid
+    try:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO document_store (filename, status, content_hash) VALUES (?, ?, ?)',
+                       (filename, status, content_hash))
+        file_id = cursor.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    return file_id
+
+def get_document_by_hash(content_hash):
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, filename, status FROM document_store WHERE content_hash = ?',
+                       (content_hash,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_document(file_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, filename, status, content_hash FROM document_store WHERE id = ?',
+                       (file_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def update_document_record(file_id, filename, content_hash):
+    """Point a document row at a new version; raises sqlite3.IntegrityError if `content_hash` belongs to another document."""
+    conn = get_db_connection()
+    try:
+        conn.execute('UPDATE document_store SET filename = ?, content_hash = ?, upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?',
+                     (filename, content_hash, file_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def mark_document_ready(file_id):
+    conn = get_db_connection()
+    conn.execute("UPDATE document_store SET status = 'ready' WHERE id = ?", (file_id,))
     conn.commit()
     conn.close()
-    return file_id
 
 def delete_document_record(file_id):
     conn = get_db_connection()
@@ -66,11 +302,267 @@ def delete_document_record(file_id):
 def get_all_documents():
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
+    cursor.execute("SELECT id, filename, upload_timestamp FROM document_store WHERE status = 'ready' ORDER BY upload_timestamp DESC")
     documents = cursor.fetchall()
     conn.close()
     return [dict(doc) for doc in documents]
 
+# ── Document listing and bulk delete ─────────────────────────────────
+# Pages are ordered newest first on (upload_timestamp, id). The cursor is
+# the last row of the previous page, so each page is one range scan of
+# idx_document_store_listing however deep it is
+def encode_document_cursor(document: dict) -> str:
+    raw = json.dumps([str(document['upload_timestamp']), document['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_document_cursor(cursor: str) -> tuple:
+    """Inverse of `encode_document_cursor`; raises ValueError for a malformed cursor."""
+    try:
+        timestamp, file_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(timestamp), int(file_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def sqlite_timestamp(value: datetime) -> str:
+    """`value` in the format and time zone (UTC) of CURRENT_TIMESTAMP columns."""
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def get_documents_page(limit, cursor=None, filename=None, uploaded_after=None, uploaded_before=None):
+    """
+    One page of ready documents, newest first, and the cursor of the next
+    page (None on the last one). `filename` matches case-insensitively
+    anywhere in the name; raises ValueError for a malformed cursor.
+    """
+    clauses, params = ["status = 'ready'"], []
+    if cursor:
+        clauses.append('(upload_timestamp, id) < (?, ?)')
+        params.extend(decode_document_cursor(cursor))
+    if filename:
+        clauses.append("filename LIKE ? ESCAPE '\\'")
+        params.append('%' + re.sub(r'([\\%_])', r'\\\1', filename) + '%')
+    if uploaded_after:
+        clauses.append('upload_timestamp >= ?')
+        params.append(sqlite_timestamp(uploaded_after))
+    if uploaded_before:
+        clauses.append('upload_timestamp < ?')
+        params.append(sqlite_timestamp(uploaded_before))
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT id, filename, upload_timestamp FROM document_store WHERE {' AND '.join(clauses)} "
+                        "ORDER BY upload_timestamp DESC, id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+    conn.close()
+    documents = [dict(row) for row in rows[:limit]]
+    return documents, (encode_document_cursor(documents[-1]) if len(rows) > limit else None)
+
+def get_document_statuses(file_ids):
+    """{file_id: status} of the given documents that exist."""
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT id, status FROM document_store WHERE id IN ({','.join('?' * len(file_ids))})",
+                        list(file_ids)).fetchall()
+    conn.close()
+    return {row['id']: row['status'] for row in rows}
+
+def delete_document_records(file_ids):
+    """Delete many document rows in one transaction; returns the number deleted."""
+    conn = get_db_connection()
+    try:
+        deleted = conn.execute(f"DELETE FROM document_store WHERE id IN ({','.join('?' * len(file_ids))})",
+                               list(file_ids)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+def create_index_meta():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS index_meta
+                    (key TEXT PRIMARY KEY,
+                     value INTEGER NOT NULL)''')
+    conn.execute("INSERT OR IGNORE INTO index_meta (key, value) VALUES ('index_version', 0)")
+    conn.commit()
+    conn.close()
+
+def get_index_version():
+    conn = get_db_connection()
+    row = conn.execute("SELECT value FROM index_meta WHERE key = 'index_version'").fetchone()
+    conn.close()
+    return row['value'] if row else 0
+
+def bump_index_version():
+    """Record that the Chroma collection changed; caches keyed on the old version become stale."""
+    conn = get_db_connection()
+    conn.execute("UPDATE index_meta SET value = value + 1 WHERE key = 'index_version'")
+    conn.commit()
+    row = conn.execute("SELECT value FROM index_meta WHERE key = 'index_version'").fetchone()
+    conn.close()
+    return row['value']
+
+def create_ingest_jobs():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingest_jobs
+                    (id TEXT PRIMARY KEY,
+                     filename TEXT,
+                     file_path TEXT,
+                     file_id INTEGER,
+                     status TEXT,
+                     stage TEXT,
+                     chunks_total INTEGER DEFAULT 0,
+                     chunks_embedded INTEGER DEFAULT 0,
+                     timings TEXT DEFAULT '{}',
+                     error TEXT,
+                     attempts INTEGER DEFAULT 0,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.close()
+
+def insert_ingest_job(job_id, filename, file_path, file_id, owner=None, lease_expires=None):
+    conn = get_db_connection()
+    conn.execute('''INSERT INTO ingest_jobs (id, filename, file_path, file_id, status, stage, owner, lease_expires)
+                    VALUES (?, ?, ?, ?, 'queued', 'queued', ?, ?)''',
+                 (job_id, filename, file_path, file_id, owner, lease_expires))
+    conn.commit()
+    conn.close()
+
+def update_ingest_job(job_id, **fields):
+    if 'timings' in fields:
+        fields['timings'] = json.dumps(fields['timings'])
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    conn = get_db_connection()
+    conn.execute(f'UPDATE ingest_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                 (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+
+def get_ingest_job(job_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM ingest_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['timings'] = json.loads(job['timings'] or '{}')
+    return job
+
+def get_unfinished_ingest_jobs():
+    conn = get_db_connection()
+    rows = conn.execute("SELECT id FROM ingest_jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+    conn.close()
+    return [row['id'] for row in rows]
+
+def claim_ingest_job(job_id, owner, lease_expires):
+    """
+    Take over an unfinished job that has no owner or whose owner's lease ran
+    out. The check and the update are one statement, so of several processes
+    claiming the same job exactly one succeeds.
+    """
+    conn = get_db_connection()
+    cursor = conn.execute('''UPDATE ingest_jobs SET owner = ?, lease_expires = ?
+                             WHERE id = ? AND status IN ('queued', 'running')
+                               AND (owner IS NULL OR lease_expires < ?)''',
+                          (owner, lease_expires, job_id, time.time()))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount == 1
+
+def renew_ingest_leases(owner, lease_expires):
+    """Extend the lease on every unfinished job held by `owner`."""
+    conn = get_db_connection()
+    conn.execute("UPDATE ingest_jobs SET lease_expires = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                 (lease_expires, owner))
+    conn.commit()
+    conn.close()
+
+def release_queued_ingest_jobs(owner):
+    """Give up `owner`'s jobs that have not started so another worker can claim them right away."""
+    conn = get_db_connection()
+    conn.execute("UPDATE ingest_jobs SET owner = NULL, lease_expires = NULL WHERE owner = ? AND status = 'queued'",
+                 (owner,))
+    conn.commit()
+    conn.close()
+
+REQUEST_METRICS_COLUMNS = ('request_id', 'session_id', 'endpoint', 'route', 'status', 'total_ms', 'llm_calls',
+                           'input_tokens', 'output_tokens', 'cost_usd', 'spans', 'created_at')
+
+def create_request_metrics():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS request_metrics
+                    (request_id TEXT PRIMARY KEY,
+                     session_id TEXT,
+                     endpoint TEXT,
+                     route TEXT,
+                     status TEXT,
+                     total_ms REAL,
+                     llm_calls INTEGER,
+                     input_tokens INTEGER,
+                     output_tokens INTEGER,
+                     cost_usd REAL,
+                     spans TEXT,
+                     created_at TIMESTAMP)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_request_metrics_route_created ON request_metrics (route, created_at)')
+    conn.close()
+
+def write_request_metrics_rows(rows):
+    conn = get_db_connection()
+    try:
+        conn.executemany(f'INSERT OR REPLACE INTO request_metrics ({", ".join(REQUEST_METRICS_COLUMNS)}) '
+                         f'VALUES ({", ".join("?" * len(REQUEST_METRICS_COLUMNS))})', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def insert_request_metrics(request_id, session_id, endpoint, route, status, total_ms, llm_calls,
+                           input_tokens, output_tokens, cost_usd, spans):
+    """Store one request's timings; `spans` is a list of dicts stored as JSON."""
+    row = (request_id, session_id, endpoint, route, status, total_ms, llm_calls, input_tokens, output_tokens,
+           cost_usd, json.dumps(spans), datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    if request_metrics_writer:
+        request_metrics_writer.enqueue(row)
+    else:
+        write_request_metrics_rows([row])
+
+# ── Migrations ───────────────────────────────────────────────────────
+# Applied in order at startup; PRAGMA user_version records how many ran.
+MIGRATIONS = [
+    # 1: get_chat_history filters by session and sorts by time
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_session_created ON chat_history (session_id, created_at)",
+    # 2: get_documents_page pages through ready documents newest first
+    "CREATE INDEX IF NOT EXISTS idx_document_store_listing ON document_store (status, upload_timestamp, id)",
+    # 3, 4: the process working on an ingest job and until when its claim holds
+    "ALTER TABLE ingest_jobs ADD COLUMN owner TEXT",
+    "ALTER TABLE ingest_jobs ADD COLUMN lease_expires REAL",
+]
+
+def run_migrations():
+    conn = get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {number}')
+    conn.commit()
+    conn.close()
+
+# ── Async wrappers ───────────────────────────────────────────────────
+# sqlite3 is blocking, so the async API runs each call in a worker thread
+# instead of stalling the event loop.
+async def aget_chat_history(session_id):
+    return await asyncio.to_thread(get_chat_history, session_id)
+
+async def ainsert_chat_history(session_id, user_query, gpt_response, model):
+    return await asyncio.to_thread(insert_chat_history, session_id, user_query, gpt_response, model)
+
 # Initialize the database tables
 create_chat_history()
 create_document_store()
+create_index_meta()
+create_ingest_jobs()
+create_session_summaries()
+create_request_metrics()
+run_migrations()
+
+chat_history_writer = (WriteBehindWriter(write_chat_history_rows, DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL,
+                                         name="chat-history-writer")
+                       if DB_WRITE_BEHIND else None)
+request_metrics_writer = (WriteBehindWriter(write_request_metrics_rows, DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL,
+                                            name="request-metrics-writer")
+                          if DB_WRITE_BEHIND else None)
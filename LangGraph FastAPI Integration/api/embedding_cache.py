@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+# In-memory LRU of query embeddings keyed by the exact query text (0 disables)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1000"))
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embedding model.
+
+    Document vectors are stored as float32 blobs keyed by (model name,
+    SHA-256 of the chunk text), so re-uploads, overlapping chunks and
+    boilerplate shared across files are only embedded once. Cache misses
+    are sent to the underlying model in batches. Query embeddings are kept
+    in a small in-memory LRU, since the same questions tend to repeat.
+    """
+
+    def __init__(self, underlying: Embeddings, db_path: str = EMBEDDING_CACHE_PATH,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.underlying = underlying
+        self.query_cache_size = query_cache_size
+        self._queries: "OrderedDict[str, array]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._query_stats = {"hits": 0, "misses": 0}
+        self.model_name = getattr(underlying, "model", type(underlying).__name__)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache
+                        (model TEXT,
+                         text_hash TEXT,
+                         vector BLOB,
+                         PRIMARY KEY (model, text_hash)) WITHOUT ROWID''')
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        conn = self._connect()
+        for i in range(0, len(hashes), _LOOKUP_CHUNK):
+            chunk = hashes[i:i + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f'SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})',
+                [self.model_name, *chunk]).fetchall()
+            for h, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[h] = vector.tolist()
+        conn.close()
+        return found
+
+    def _store(self, hashes: List[str], vectors: List[List[float]]):
+        conn = self._connect()
+        conn.executemany('INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector) VALUES (?, ?, ?)',
+                         [(self.model_name, h, array("f", v).tobytes()) for h, v in zip(hashes, vectors)])
+        conn.commit()
+        conn.close()
+
+    def _plan(self, texts: List[str]):
+        hashes = [text_hash(t) for t in texts]
+        unique = list(dict.fromkeys(hashes))
+        found = self._lookup(unique)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+        return hashes, found, missing
+
+    def _batches(self, missing: Dict[str, str]):
+        items = list(missing.items())
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            yield [h for h, _ in batch], [t for _, t in batch]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._plan(texts)
+        for batch_hashes, batch_texts in self._batches(missing):
+            vectors = self.underlying.embed_documents(batch_texts)
+            self._store(batch_hashes, vectors)
+            found.update(zip(batch_hashes, vectors))
+        return [found[h] for h in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = await asyncio.to_thread(self._plan, texts)
+        for batch_hashes, batch_texts in self._batches(missing):
+            vectors = await self.underlying.aembed_documents(batch_texts)
+            await asyncio.to_thread(self._store, batch_hashes, vectors)
+            found.update(zip(batch_hashes, vectors))
+        return [found[h] for h in hashes]
+
+    # ── Query embeddings ────────────────────────────────────────────
+    def _cached_query(self, text: str):
+        with self._query_lock:
+            vector = self._queries.get(text)
+            if vector is None:
+                self._query_stats["misses"] += 1
+                return None
+            self._queries.move_to_end(text)
+            self._query_stats["hits"] += 1
+            return vector.tolist()
+
+    def _remember_query(self, text: str, vector: List[float]):
+        if self.query_cache_size <= 0:
+            return
+        with self._query_lock:
+            # float32 keeps an entry at ~6 KB for 1536 dimensions
+            self._queries[text] = array("f", vector)
+            self._queries.move_to_end(text)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def query_cache_stats(self) -> dict:
+        with self._query_lock:
+            return {**self._query_stats, "entries": len(self._queries)}
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self._remember_query(text, vector)
+        return vector
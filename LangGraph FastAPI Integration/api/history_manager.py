@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+from functools import lru_cache
+from typing import List
+import tiktoken
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage, RemoveMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from startup import Lazy
+from db_utils import get_chat_turns, get_session_summary, upsert_session_summary
+from shared import chat_model
+
+# ── Configuration ────────────────────────────────────────────────────
+# Tokens of raw history (plus the rolling summary) sent with each turn
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Upper bound on rows read per turn, whatever their size
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "50"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4.1-mini")
+# Rough per-message overhead of the chat format
+MESSAGE_TOKEN_OVERHEAD = 4
+# Fixed id of the summary SystemMessage, so add_messages overwrites it in place
+SUMMARY_MESSAGE_ID = "session-summary"
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", (
+        "You maintain a running summary of a conversation between a user and an AI assistant. "
+        "Extend the existing summary with the new turns. Keep names, facts, numbers and open "
+        "questions the user may refer back to. Keep it under {max_words} words. "
+        "Return only the updated summary."
+    )),
+    ("human", "Existing summary:\n{summary}\n\nNew turns:\n{turns}"),
+])
+summary_chain = Lazy("summary_chain", lambda: (
+    summary_prompt | chat_model(model=HISTORY_SUMMARY_MODEL, temperature=0)
+    | StrOutputParser()).with_config(run_name="history_summary_chain"))
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text or ""))
+
+def turn_tokens(turn: dict) -> int:
+    return count_tokens(turn['user_query']) + count_tokens(turn['gpt_response']) + 2 * MESSAGE_TOKEN_OVERHEAD
+
+def split_window(session_id: str, limit=HISTORY_MAX_TURNS):
+    """
+    Return (summary row, turns inside the budget, unsummarised turns that no
+    longer fit), both turn lists oldest first.
+    """
+    summary = get_session_summary(session_id)
+    turns = get_chat_turns(session_id, after_id=summary['summarized_until'], limit=limit)
+
+    budget = HISTORY_TOKEN_BUDGET - count_tokens(summary['summary'])
+    window, overflow = [], []
+    for turn in turns:  # newest first
+        cost = turn_tokens(turn)
+        if not overflow and cost <= budget:
+            window.append(turn)
+            budget -= cost
+        else:
+            overflow.append(turn)
+    return summary, list(reversed(window)), list(reversed(overflow))
+
+def summary_message(summary: str) -> SystemMessage:
+    return SystemMessage(content=f"Summary of the earlier conversation:\n{summary}", id=SUMMARY_MESSAGE_ID)
+
+def load_history_window(session_id: str) -> List[BaseMessage]:
+    """Messages for the next turn: the rolling summary plus the most recent turns that fit the budget."""
+    summary, window, _ = split_window(session_id)
+    messages = []
+    if summary['summary']:
+        messages.append(summary_message(summary['summary']))
+    for turn in window:
+        messages.append(HumanMessage(content=turn['user_query']))
+        messages.append(AIMessage(content=turn['gpt_response']))
+    return messages
+
+async def aload_history_window(session_id: str) -> List[BaseMessage]:
+    return await asyncio.to_thread(load_history_window, session_id)
+
+def message_tokens(message: BaseMessage) -> int:
+    return count_tokens(message.content) + MESSAGE_TOKEN_OVERHEAD
+
+def trim_to_budget(messages: List[BaseMessage], summary: str = "") -> tuple[List[BaseMessage], List[BaseMessage]]:
+    """
+    Apply HISTORY_TOKEN_BUDGET to checkpointed session messages and bring the
+    leading summary SystemMessage up to date with `summary`. Returns the
+    messages to keep and the updates for the checkpointed state: RemoveMessage
+    markers for the oldest turns that no longer fit plus the refreshed summary.
+    """
+    head = messages[:1] if messages and isinstance(messages[0], SystemMessage) else []
+    rest = messages[len(head):]
+    if summary:
+        current = summary_message(summary)
+    else:
+        current = head[0] if head else None
+    budget = HISTORY_TOKEN_BUDGET - (message_tokens(current) if current else 0)
+    kept = []
+    for message in reversed(rest):
+        budget -= message_tokens(message)
+        if budget < 0:
+            break
+        kept.append(message)
+    kept.reverse()
+    # Never start the window with an orphaned answer
+    while kept and not isinstance(kept[0], HumanMessage):
+        kept.pop(0)
+    window = ([current] if current else []) + kept
+    if current and not (head and head[0].id == current.id):
+        # add_messages appends new ids, so a summary that was not seeded
+        # under SUMMARY_MESSAGE_ID can only reach the head by a rewrite
+        return window, [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + window
+    dropped = rest[:len(rest) - len(kept)]
+    updates = [RemoveMessage(id=m.id) for m in dropped]
+    if current and current is not head[0]:
+        updates.append(current)
+    return window, updates
+
+async def afold_history(session_id: str):
+    """Fold turns that dropped out of the window into the persisted summary."""
+    summary, _, overflow = await asyncio.to_thread(split_window, session_id, None)
+    # Only committed turns can be folded; queued ones have no id yet
+    overflow = [t for t in overflow if t['id'] is not None]
+    if not overflow:
+        return
+    turns = "\n".join(f"User: {t['user_query']}\nAssistant: {t['gpt_response']}" for t in overflow)
+    new_summary = await summary_chain.ainvoke({
+        "summary": summary['summary'] or "(none)",
+        "turns": turns,
+        # leave most of the budget to the raw recent turns
+        "max_words": max(HISTORY_TOKEN_BUDGET // 4, 50),
+    })
+    await asyncio.to_thread(upsert_session_summary, session_id, new_summary, max(t['id'] for t in overflow))
+    logging.info(f"Session ID: {session_id}, folded {len(overflow)} turns into the summary")
+
+# Sessions with a fold in flight, and strong references to the running tasks
+_folding = set()
+_fold_tasks = set()
+
+def schedule_history_fold(session_id: str):
+    """Update the summary in the background, off the request path."""
+    if session_id in _folding:
+        return
+    _folding.add(session_id)
+
+    async def run():
+        try:
+            await afold_history(session_id)
+        except Exception as e:
+            logging.error(f"Session ID: {session_id}, history fold failed: {e}")
+        finally:
+            _folding.discard(session_id)
+
+    task = asyncio.create_task(run())
+    _fold_tasks.add(task)
+    task.add_done_callback(_fold_tasks.discard)
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+import httpx
+from metrics import upstream_retries, span_seconds
+
+# ── Configuration ────────────────────────────────────────────────────
+# One keep-alive pool shared by every OpenAI chat and embedding client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+# Requests in flight per upstream host and kind; 0 disables the limit
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+# Retries of 408/409/429/5xx responses and connection errors
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_RETRY_BASE_DELAY = float(os.getenv("HTTP_RETRY_BASE_DELAY", "0.5"))
+# A Retry-After longer than this is not waited for; the error goes back to the caller
+HTTP_RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "20"))
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+def upstream_kind(request: httpx.Request) -> str:
+    path = request.url.path
+    if path.endswith("/embeddings"):
+        return "embedding"
+    if path.endswith("/chat/completions") or path.endswith("/responses"):
+        return "llm"
+    return "other"
+
+def concurrency_limit(kind: str) -> int:
+    return {"llm": LLM_MAX_CONCURRENCY, "embedding": EMBEDDING_MAX_CONCURRENCY}.get(kind, 0)
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds the server asked us to wait (`retry-after-ms` or `Retry-After`), if any."""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, response: Optional[httpx.Response] = None) -> Optional[float]:
+    """
+    Delay before retry `attempt` (0-based), or None to give up. Retry-After
+    is honoured with a little jitter on top so throttled callers do not all
+    come back at once; otherwise full-jitter exponential backoff.
+    """
+    if attempt >= HTTP_MAX_RETRIES:
+        return None
+    requested = retry_after(response) if response is not None else None
+    if requested is not None:
+        if requested > HTTP_RETRY_MAX_DELAY:
+            return None
+        return requested + random.uniform(0, HTTP_RETRY_BASE_DELAY)
+    return random.uniform(0, min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * 2 ** attempt))
+
+def _once(release: Callable[[], None]) -> Callable[[], None]:
+    done = False
+
+    def call():
+        nonlocal done
+        if not done:
+            done = True
+            release()
+    return call
+
+# ── Async transport ──────────────────────────────────────────────────
+class _ReleasingAsyncStream(httpx.AsyncByteStream):
+    """Holds the upstream slot until a (possibly streamed) body is fully read or closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+class LimitedRetryTransport(httpx.AsyncBaseTransport):
+    """
+    Pooled transport adding a concurrency limit per upstream (host, kind)
+    and retries with jittered backoff. A slot is held across retries, so a
+    throttled upstream slows its own callers down instead of being hit by
+    more requests.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self._semaphores: Dict[tuple, asyncio.Semaphore] = {}
+
+    def _semaphore(self, request: httpx.Request) -> Optional[asyncio.Semaphore]:
+        kind = upstream_kind(request)
+        limit = concurrency_limit(kind)
+        if not limit:
+            return None
+        key = (request.url.host, kind)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(limit)
+        return self._semaphores[key]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphore(request)
+        kind = upstream_kind(request)
+        if semaphore is not None:
+            t0 = time.perf_counter()
+            await semaphore.acquire()
+            span_seconds.labels("http_queue", kind).observe(time.perf_counter() - t0)
+            release = _once(semaphore.release)
+        else:
+            release = _once(lambda: None)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await self._transport.handle_async_request(request)
+                except RETRY_ERRORS as e:
+                    delay = backoff_delay(attempt)
+                    if delay is None:
+                        raise
+                    upstream_retries.labels(kind, type(e).__name__).inc()
+                else:
+                    if response.status_code not in RETRY_STATUS:
+                        break
+                    delay = backoff_delay(attempt, response)
+                    if delay is None:
+                        break
+                    # Read the (small) error body so the connection goes back to the pool
+                    await response.aread()
+                    await response.aclose()
+                    upstream_retries.labels(kind, str(response.status_code)).inc()
+                logging.warning(f"Retrying {kind} request to {request.url.host} in {delay:.2f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+                attempt += 1
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingAsyncStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+# ── Sync transport ───────────────────────────────────────────────────
+# Used by the sync LangChain paths (ingest workers embedding chunks);
+# its limits are separate from the async transport's.
+class _ReleasingSyncStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class SyncLimitedRetryTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._semaphores: Dict[tuple, threading.BoundedSemaphore] = {}
+
+    def _semaphore(self, request: httpx.Request) -> Optional[threading.BoundedSemaphore]:
+        kind = upstream_kind(request)
+        limit = concurrency_limit(kind)
+        if not limit:
+            return None
+        with self._lock:
+            return self._semaphores.setdefault((request.url.host, kind), threading.BoundedSemaphore(limit))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphore(request)
+        kind = upstream_kind(request)
+        if semaphore is not None:
+            t0 = time.perf_counter()
+            semaphore.acquire()
+            span_seconds.labels("http_queue", kind).observe(time.perf_counter() - t0)
+            release = _once(semaphore.release)
+        else:
+            release = _once(lambda: None)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self._transport.handle_request(request)
+                except RETRY_ERRORS as e:
+                    delay = backoff_delay(attempt)
+                    if delay is None:
+                        raise
+                    upstream_retries.labels(kind, type(e).__name__).inc()
+                else:
+                    if response.status_code not in RETRY_STATUS:
+                        break
+                    delay = backoff_delay(attempt, response)
+                    if delay is None:
+                        break
+                    response.read()
+                    response.close()
+                    upstream_retries.labels(kind, str(response.status_code)).inc()
+                logging.warning(f"Retrying {kind} request to {request.url.host} in {delay:.2f}s (attempt {attempt + 1})")
+                time.sleep(delay)
+                attempt += 1
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingSyncStream(response.stream, release)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+# ── Shared clients ───────────────────────────────────────────────────
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+async_http_client = httpx.AsyncClient(
+    transport=LimitedRetryTransport(httpx.AsyncHTTPTransport(limits=_limits())),
+    timeout=HTTP_TIMEOUT,
+)
+sync_http_client = httpx.Client(
+    transport=SyncLimitedRetryTransport(httpx.HTTPTransport(limits=_limits())),
+    timeout=HTTP_TIMEOUT,
+)
+
+def openai_client_kwargs() -> dict:
+    """
+    Keyword arguments for `ChatOpenAI` / `OpenAIEmbeddings` so every model
+    shares the pooled clients. The SDK's own retries are turned off since
+    the transport retries (and counts) them.
+    """
+    return {"http_client": sync_http_client, "http_async_client": async_http_client, "max_retries": 0}
+
+async def close_http_clients():
+    await async_http_client.aclose()
+    sync_http_client.close()
@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from db_utils import (get_ingest_job, update_ingest_job, get_unfinished_ingest_jobs, claim_ingest_job,
+                      renew_ingest_leases, release_queued_ingest_jobs, mark_document_ready, delete_document_record, bump_index_version)
+from chroma_utils import iter_document_splits, add_splits_to_chroma, delete_doc_from_chroma
+from parallel_loader import shutdown_executor
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Maximum number of queued + running jobs; further uploads are rejected
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100"))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds a worker's claim on a job holds without renewal. Workers renew
+# their claims every third of this and, as often, take over jobs whose
+# claim ran out because their worker died.
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "60"))
+# Identifies this process as the owner of the ingest jobs it runs
+INGEST_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_expiry() -> float:
+    return time.time() + INGEST_LEASE_SECONDS
+
+class QueueFullError(Exception):
+    pass
+
+def save_upload(fileobj, suffix: str) -> tuple[str, str]:
+    """
+    Stream an upload to a uniquely named file in UPLOAD_DIR while hashing it.
+    Returns (path, sha256 hex digest).
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_DIR)
+    digest = hashlib.sha256()
+    with os.fdopen(fd, "wb") as buffer:
+        while chunk := fileobj.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return path, digest.hexdigest()
+
+def run_ingest_job(job_id: str):
+    """Load, split, embed and add one uploaded file, recording progress in `ingest_jobs`."""
+    job = get_ingest_job(job_id)
+    file_id, file_path = job['file_id'], job['file_path']
+    timings = {}
+    try:
+        update_ingest_job(job_id, status='running', stage='load', attempts=job['attempts'] + 1, error=None)
+        if job['attempts']:
+            # A previous attempt was interrupted (e.g. by a restart); drop its partial chunks
+            delete_doc_from_chroma(file_id)
+
+        chunks_total = 0
+        for splits in iter_document_splits(file_path, timings):
+            update_ingest_job(job_id, stage='embed', chunks_total=chunks_total + len(splits), timings=timings)
+            add_splits_to_chroma(
+                splits, file_id,
+                on_progress=lambda done, base=chunks_total: update_ingest_job(job_id, chunks_embedded=base + done, timings=timings),
+                timings=timings,
+            )
+            chunks_total += len(splits)
+        bump_index_version()
+
+        # Only now does the document show up in /list-docs
+        mark_document_ready(file_id)
+        update_ingest_job(job_id, status='completed', stage='done', timings=timings)
+        logging.info(f"Ingest job {job_id}: indexed {chunks_total} chunks for file_id {file_id} ({timings})")
+    except Exception as e:
+        logging.error(f"Ingest job {job_id} failed: {e}")
+        delete_doc_from_chroma(file_id)
+        delete_document_record(file_id)
+        update_ingest_job(job_id, status='failed', error=str(e), timings=timings)
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+class IngestionQueue:
+    """
+    Bounded worker pool running ingest jobs in the background.
+
+    Jobs live in the shared `ingest_jobs` table, so several API processes may
+    see the same job. Each job is owned by the process that inserted or
+    claimed it (`INGEST_OWNER`). A heartbeat thread keeps the owner's leases
+    alive while it has jobs in flight and picks up orphaned jobs.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, max_pending: int = INGEST_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="ingest-lease", daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(INGEST_LEASE_SECONDS / 3):
+            try:
+                with self._lock:
+                    busy = self._in_flight > 0
+                if busy:
+                    renew_ingest_leases(INGEST_OWNER, lease_expiry())
+                self.recover()
+            except Exception as e:
+                logging.error(f"Ingest lease heartbeat failed: {e}")
+
+    def _done(self, acquired: bool):
+        with self._lock:
+            self._in_flight -= 1
+        if acquired:
+            self._slots.release()
+
+    def submit(self, job_id: str, bounded: bool = True):
+        acquired = self._slots.acquire(blocking=False)
+        if bounded and not acquired:
+            raise QueueFullError("Ingestion queue is full, try again later.")
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(run_ingest_job, job_id)
+        future.add_done_callback(lambda _: self._done(acquired))
+
+    def recover(self):
+        """
+        Re-enqueue jobs whose process stopped while they were queued or
+        running. Jobs a live worker (this one included) holds a lease on are
+        left alone.
+        """
+        for job_id in get_unfinished_ingest_jobs():
+            if not claim_ingest_job(job_id, INGEST_OWNER, lease_expiry()):
+                continue
+            job = get_ingest_job(job_id)
+            if os.path.exists(job['file_path']):
+                logging.info(f"Resuming ingest job {job_id}")
+                self.submit(job_id, bounded=False)
+            else:
+                delete_doc_from_chroma(job['file_id'])
+                delete_document_record(job['file_id'])
+                update_ingest_job(job_id, status='failed', error='Upload file missing after restart')
+
+    def shutdown(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Jobs that never started are free to claim at once; a running job
+        # keeps its lease until it expires, since its thread may still finish
+        release_queued_ingest_jobs(INGEST_OWNER)
+        shutdown_executor()
+
+ingestion_queue = IngestionQueue()
@@ -1,6 +1,12 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from shared import planner_llm, chat_model
+from startup import Lazy
+import os
+
+# PLANNER_MODE=true replaces contextualise_chain + the router LLM call with
+# a single structured call to planner_chain
+PLANNER_MODE = os.getenv("PLANNER_MODE", "false").lower() == "true"
 
 
 
@@ -20,4 +26,24 @@ CONTEXT_PROMPT = ChatPromptTemplate.from_messages([
 ])
 
 
-contextualise_chain = ( CONTEXT_PROMPT | ChatOpenAI(model_name="gpt-4.1-mini", temperature=0) | StrOutputParser()).with_config(run_name="contextualise_chain")
+contextualise_chain = Lazy("contextualise_chain", lambda: ( CONTEXT_PROMPT | chat_model(model_name="gpt-4.1-mini", temperature=0) | StrOutputParser()).with_config(run_name="contextualise_chain"))
+
+
+planner_system_prompt = (
+    "You plan how to handle the latest user message of a conversation.\n"
+    "1. standalone_question: rewrite the latest message as a standalone question which can be "
+    "understood without the chat history. Do NOT answer it; if it is already standalone, return it as is.\n"
+    "2. route:\n"
+    "- Use 'end' for pure greetings/small-talk (also provide a 'reply') and answer that is already in the current conversation chat history\n"
+    "- Use 'rag' when knowledge base lookup is needed\n"
+    "- Use 'answer' when you can answer directly without external info"
+)
+
+PLANNER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", planner_system_prompt),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}")
+])
+
+# `|` needs the model itself, not its Lazy wrapper
+planner_chain = Lazy("planner_chain", lambda: (PLANNER_PROMPT | planner_llm.instance()).with_config(run_name="planner_chain"))
@@ -1,8 +1,12 @@
 from typing import Literal
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from nodes import router_node, rag_node, web_node, answer_node
+from nodes import (router_node, rag_node, web_node, answer_node,
+                   arouter_node, arag_node, aweb_node, aanswer_node)
 from shared import AgentState
+from session_state import session_checkpointer
+from startup import Lazy
 
 # ── Routing helpers ─────────────────────────────────────────────────
 def from_router(st: AgentState) -> Literal["rag", "answer", "end"]:
@@ -15,19 +19,28 @@ def after_web(_) -> Literal["answer"]:
     return "answer"
 
 # ── Build graph ─────────────────────────────────────────────────────
-g = StateGraph(AgentState)
-g.add_node("router", router_node)
-g.add_node("rag_lookup", rag_node)
-g.add_node("web_search", web_node)
-g.add_node("answer", answer_node)
+# Each node pairs the sync and async implementation, so `agent.invoke`
+# and `agent.ainvoke` both run without blocking on the other flavour.
+def build_agent(checkpointer=session_checkpointer):
+    g = StateGraph(AgentState)
+    g.add_node("router", RunnableLambda(router_node, afunc=arouter_node))
+    g.add_node("rag_lookup", RunnableLambda(rag_node, afunc=arag_node))
+    g.add_node("web_search", RunnableLambda(web_node, afunc=aweb_node))
+    g.add_node("answer", RunnableLambda(answer_node, afunc=aanswer_node))
 
-g.set_entry_point("router")
-g.add_conditional_edges("router", from_router,
-                        {"rag": "rag_lookup", "answer": "answer", "end": END})
-g.add_conditional_edges("rag_lookup", after_rag,
-                        {"answer": "answer", "web": "web_search"})
-g.add_edge("web_search",  "answer")
-g.add_edge("answer", END)
+    g.set_entry_point("router")
+    g.add_conditional_edges("router", from_router,
+                            {"rag": "rag_lookup", "answer": "answer", "end": END})
+    g.add_conditional_edges("rag_lookup", after_rag,
+                            {"answer": "answer", "web": "web_search"})
+    g.add_edge("web_search",  "answer")
+    g.add_edge("answer", END)
 
-agent = g.compile()
+    # With SESSION_STATE_BACKEND=checkpointer each session is a graph thread
+    return g.compile(checkpointer=checkpointer)
 
+# Compiled on first use (or by the start-up warm-up, see startup.py).
+# `agent` needs a thread id (`session_config`) when sessions are
+# checkpointed; `stateless_agent` runs one turn from the messages it is given.
+agent = Lazy("agent", build_agent)
+stateless_agent = Lazy("stateless_agent", lambda: build_agent(checkpointer=None))
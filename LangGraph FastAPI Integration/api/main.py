@@ -1,102 +1,417 @@
+# First import: times the service modules imported below (see /startup-report)
+import startup
+import asyncio
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
-from db_utils import insert_chat_history, get_chat_history, get_all_documents, insert_document_record, delete_document_record
-from chroma_utils import index_document_to_chroma, delete_doc_from_chroma
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, DeleteFilesRequest, IngestJob
+from db_utils import (ainsert_chat_history, insert_document_record, delete_document_record,
+                      insert_ingest_job, update_ingest_job, get_ingest_job, get_document_by_hash, chat_history_writer,
+                      request_metrics_writer, get_document, update_document_record, get_documents_page,
+                      get_document_statuses, delete_document_records, get_session_summary)
+from chroma_utils import delete_doc_from_chroma, delete_docs_from_chroma, update_doc_in_chroma, count_doc_chunks, embedding_function
+from ingestion import ingestion_queue, QueueFullError, save_upload, INGEST_OWNER, lease_expiry
 from langgraph_agent import agent
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 import logging
-import shutil
-from utils import get_or_create_session_id, history_to_lc_messages, append_message
-from langchain_utils import contextualise_chain
+import sqlite3
+import uuid
+from utils import get_or_create_session_id, append_message, format_sse, normalize_question
+from context_packer import packer_stats
+from singleflight import agent_flight, history_fingerprint, singleflight_stats
+from history_manager import aload_history_window, schedule_history_fold, trim_to_budget
+from session_state import session_checkpointer, session_config
+from langchain_utils import contextualise_chain, planner_chain, PLANNER_MODE
+from speculation import start_speculation, agent_config, finish_speculation
+from answer_cache import alookup_answer, astore_answer, answer_cache_stats
+from tools import web_cache, retrieval_cache
+from http_clients import close_http_clients
+from metrics import start_request_trace, traced_config, finish_request_trace, render_metrics, rag_check_totals
 logging.basicConfig(filename='app.log', level=logging.INFO)
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up ingest jobs interrupted by the previous shutdown
+    ingestion_queue.recover()
+    if session_checkpointer:
+        await session_checkpointer.open()
+    # Build model clients, the Chroma store and the graph in the background
+    # so the server accepts connections right away (see /ready)
+    warmup = (asyncio.get_running_loop().run_in_executor(None, startup.warm_up)
+              if startup.STARTUP_WARMUP else None)
+    yield
+    if warmup and not warmup.done():
+        await warmup
+    ingestion_queue.shutdown()
+    if session_checkpointer:
+        await session_checkpointer.close()
+    await close_http_clients()
+    # Flush chat history rows still waiting in the write-behind queue
+    if chat_history_writer:
+        chat_history_writer.close()
+    if request_metrics_writer:
+        request_metrics_writer.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Load environment variables from .env file
 load_dotenv(override=True)
 
+FALLBACK_ANSWER = "I apologize, but I couldn't generate a response at this time."
+# Documents per /list-docs page unless the request sets `limit`
+LIST_DOCS_PAGE_SIZE = int(os.getenv("LIST_DOCS_PAGE_SIZE", "100"))
+LIST_DOCS_MAX_PAGE_SIZE = 1000
+
+async def session_messages(session_id: str) -> list[BaseMessage]:
+    """Messages of the session's checkpointed graph state (empty for new or evicted-and-unsaved sessions)."""
+    if not session_checkpointer:
+        return []
+    snapshot = await agent.aget_state(session_config(session_id))
+    return snapshot.values.get("messages", [])
+
+async def build_turn_input(session_id: str, question: str, config: dict | None = None) -> tuple[dict, str, str]:
+    """
+    Return the graph input for this turn, the contextualised question and a
+    fingerprint of the history it was contextualised against.
+
+    A session with checkpointed state only sends the new question (plus
+    removals for turns that fell out of HISTORY_TOKEN_BUDGET and the current
+    rolling summary); otherwise the history window is loaded from
+    chat_history and sent along with it.
+    """
+    messages = await session_messages(session_id)
+    if messages:
+        # The summary may have been folded forward since the state was seeded
+        summary = await asyncio.to_thread(get_session_summary, session_id)
+        messages, seed = trim_to_budget(messages, summary['summary'])
+    else:
+        # Rolling summary + the most recent turns that fit HISTORY_TOKEN_BUDGET
+        messages = seed = await aload_history_window(session_id)
+
+    plan = None
+    if PLANNER_MODE:
+        # One call yields both the stand-alone question and the route
+        result = await planner_chain.ainvoke({"chat_history": messages, "input": question}, config=config)
+        standalone_q = result.standalone_question
+        plan = {"route": result.route, "reply": result.reply}
+    else:
+        # Generate a stand-alone question
+        standalone_q = await contextualise_chain.ainvoke({
+            "chat_history": messages,
+            "input": question,
+        }, config=config)
+
+    # rag/web/plan are reset so the previous turn's values are not reused
+    turn_input = {"messages": append_message(seed, HumanMessage(content=standalone_q)),
+                  "rag": "", "rag_hits": [], "web": "", "plan": plan}
+    return turn_input, standalone_q, history_fingerprint(messages)
+
+async def record_cached_turn(session_id: str, turn_input: dict, answer: str):
+    """Append a turn answered without running the graph to the session's checkpointed state."""
+    if session_checkpointer:
+        await agent.aupdate_state(session_config(session_id),
+                                  {**turn_input, "messages": append_message(turn_input["messages"], AIMessage(content=answer))},
+                                  as_node="answer")
+
+async def record_turn(session_id: str, query_input: QueryInput, answer: str):
+    """Store the conversation and fold turns that left the history window into the summary."""
+    await ainsert_chat_history(session_id, query_input.question, answer, query_input.model.value)
+    schedule_history_fold(session_id)
+
+def last_ai_answer(state) -> str:
+    last_message = next((m for m in reversed(state.get("messages", []))
+                         if isinstance(m, AIMessage)), None)
+    return last_message.content if last_message else FALLBACK_ANSWER
+
 @app.post("/chat", response_model=QueryResponse)
-def chat(query_input: QueryInput):
+async def chat(query_input: QueryInput):
     """
     Main chat endpoint using the LangGraph agent with routing, RAG, and web search capabilities.
+    Runs fully async: history I/O, contextualisation and every graph node are awaited,
+    so a single worker can serve many concurrent sessions.
     """
     session_id = get_or_create_session_id(query_input.session_id)
     logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, Model: {query_input.model.value}")
 
+    trace = start_request_trace("/chat", session_id)
+    # In speculative mode retrieval on the raw question starts right away
+    speculation = start_speculation(query_input.question)
     try:
-        # Convert chat history to LangChain messages
-        chat_history = get_chat_history(session_id)
-        messages = history_to_lc_messages(chat_history)
-        # Add current user message
+        turn_input, standalone_q, history_key = await build_turn_input(session_id, query_input.question,
+                                                                       traced_config(trace))
 
-                # 2. Generate a stand-alone question
-        standalone_q = contextualise_chain.invoke({
-            "chat_history": messages,
-            "input": query_input.question,
-        })
-
-        messages = append_message(messages, HumanMessage(content=standalone_q))
-        # Invoke the LangGraph agent
-        # config = {"configurable": {"thread_id": session_id}}
-        result = agent.invoke(
-            {"messages": messages}
-        )
-
-        # Get the last AI message
-        last_message = next((m for m in reversed(result["messages"])
-                           if isinstance(m, AIMessage)), None)
-
-        if last_message:
-            answer = last_message.content
+        # Near-identical standalone questions are answered from the semantic cache
+        cached, question_embedding = await alookup_answer(standalone_q, history_key)
+        if cached:
+            logging.info(f"Session ID: {session_id}, Answer cache hit (similarity {cached['similarity']:.3f})")
+            answer = cached["answer"]
+            trace.route = "cache"
+            await record_cached_turn(session_id, turn_input, answer)
         else:
-            answer = "I apologize, but I couldn't generate a response at this time."
+            ran_agent = False
+
+            async def run_agent():
+                nonlocal ran_agent
+                ran_agent = True
+                # Invoke the LangGraph agent
+                return await agent.ainvoke(
+                    turn_input,
+                    config=traced_config(trace, session_config(session_id, agent_config(speculation))),
+                )
+
+            # The same question asked against the same history while a run is
+            # in flight waits for that run instead of starting another
+            result = await agent_flight.do(f"{history_key}:{normalize_question(standalone_q)}", run_agent)
+            answer = last_ai_answer(result)
+            if not ran_agent:
+                trace.route = "coalesced"
+                await record_cached_turn(session_id, turn_input, answer)
+            elif answer != FALLBACK_ANSWER:
+                await astore_answer(standalone_q, history_key, question_embedding, answer, result.get("route"))
+        finish_speculation(speculation, session_id)
 
         # Store the conversation
-        insert_chat_history(session_id, query_input.question, answer, query_input.model.value)
+        await record_turn(session_id, query_input, answer)
         logging.info(f"Session ID: {session_id}, AI Response: {answer}")
+        finish_request_trace(trace)
 
         return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
 
     except Exception as e:
+        finish_speculation(speculation, session_id)
+        finish_request_trace(trace, status="error")
         logging.error(f"Error in chat: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
-from fastapi import UploadFile, File, HTTPException
+async def stream_agent_events(query_input: QueryInput, session_id: str):
+    """
+    Yield Server-Sent Events for one chat turn: graph progress first
+    (router decision, RAG verdict, web fallback), then the answer tokens,
+    then a final `done` event once the turn has been persisted.
+    """
+    trace = start_request_trace("/chat/stream", session_id)
+    speculation = start_speculation(query_input.question)
+    try:
+        turn_input, standalone_q, history_key = await build_turn_input(session_id, query_input.question,
+                                                                       traced_config(trace))
+        yield format_sse("start", {"session_id": session_id})
+
+        cached, question_embedding = await alookup_answer(standalone_q, history_key)
+        if cached:
+            finish_speculation(speculation, session_id)
+            answer = cached["answer"]
+            trace.route = "cache"
+            yield format_sse("cache", {"hit": True, "similarity": round(cached["similarity"], 4)})
+            yield format_sse("token", {"content": answer})
+            await record_cached_turn(session_id, turn_input, answer)
+            await record_turn(session_id, query_input, answer)
+            finish_request_trace(trace)
+            yield format_sse("done", {"answer": answer, "session_id": session_id, "model": query_input.model.value})
+            return
+
+        tokens = []
+        final_state = {}
+        config = traced_config(trace, session_config(session_id, agent_config(speculation)))
+        async for event in agent.astream_events(turn_input, config=config, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
 
-@app.post("/upload-doc")
+            if kind == "on_chat_model_stream" and node == "answer":
+                content = event["data"]["chunk"].content
+                if content:
+                    tokens.append(content)
+                    yield format_sse("token", {"content": content})
+            elif kind == "on_chain_end" and event["name"] == node:
+                output = event["data"].get("output") or {}
+                if node == "router":
+                    yield format_sse("route", {"route": output.get("route")})
+                elif node == "rag_lookup":
+                    yield format_sse("rag", {"hit": bool(output.get("rag")), "route": output.get("route"),
+                                             "check": output.get("rag_check")})
+                elif node == "web_search":
+                    yield format_sse("web", {"fallback": True, "error": output.get("web", "").startswith("WEB_ERROR::")})
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                final_state = event["data"].get("output") or {}
+        finish_speculation(speculation, session_id)
+
+        # Routes that never reach answer_node (e.g. greetings) produce no tokens
+        answer = "".join(tokens) if tokens else last_ai_answer(final_state)
+        if not tokens:
+            yield format_sse("token", {"content": answer})
+        if answer != FALLBACK_ANSWER:
+            await astore_answer(standalone_q, history_key, question_embedding, answer, final_state.get("route"))
+
+        await record_turn(session_id, query_input, answer)
+        logging.info(f"Session ID: {session_id}, AI Response (stream): {answer}")
+        finish_request_trace(trace)
+        yield format_sse("done", {"answer": answer, "session_id": session_id, "model": query_input.model.value})
+
+    except Exception as e:
+        finish_speculation(speculation, session_id)
+        finish_request_trace(trace, status="error")
+        logging.error(f"Error in chat stream: {str(e)}")
+        yield format_sse("error", {"detail": f"Chat error: {str(e)}"})
+
+@app.post("/chat/stream")
+async def chat_stream(query_input: QueryInput):
+    """Streaming variant of `/chat` using Server-Sent Events."""
+    session_id = get_or_create_session_id(query_input.session_id)
+    logging.info(f"Session ID: {session_id}, User Query (stream): {query_input.question}, Model: {query_input.model.value}")
+    return StreamingResponse(
+        stream_agent_events(query_input, session_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/upload-doc", status_code=202)
 def upload_and_index_document(file: UploadFile = File(...)):
+    """
+    Save the upload and queue it for background indexing. Returns a job id
+    right away; poll `/jobs/{job_id}` for progress. The document only shows
+    up in `/list-docs` once indexing has finished.
+    """
     allowed_extensions = ['.pdf', '.docx', '.html']
     file_extension = os.path.splitext(file.filename)[1].lower()
     
     if file_extension not in allowed_extensions:
         raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
     
-    temp_file_path = f"temp_{file.filename}"
-    
+    # Save the uploaded file; it is removed by the worker once indexing ends
+    upload_path, content_hash = save_upload(file.file, file_extension)
+
+    # Identical bytes already indexed (or being indexed) are not processed again
     try:
-        # Save the uploaded file to a temporary file
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        file_id = insert_document_record(file.filename)
-        success = index_document_to_chroma(temp_file_path, file_id)
-        
-        if success:
-            return {"message": f"File {file.filename} has been successfully uploaded and indexed.", "file_id": file_id}
-        else:
-            delete_document_record(file_id)
-            raise HTTPException(status_code=500, detail=f"Failed to index {file.filename}.")
+        file_id = insert_document_record(file.filename, status='pending', content_hash=content_hash)
+    except sqlite3.IntegrityError:
+        os.remove(upload_path)
+        existing = get_document_by_hash(content_hash)
+        if existing is None:
+            # The matching document was deleted in the meantime
+            raise HTTPException(status_code=409, detail=f"Concurrent change while uploading {file.filename}, please retry.")
+        return {"message": f"File {file.filename} is identical to already uploaded {existing['filename']}.",
+                "file_id": existing['id'], "status": existing['status'], "duplicate": True}
+
+    job_id = uuid.uuid4().hex
+    insert_ingest_job(job_id, file.filename, upload_path, file_id, owner=INGEST_OWNER, lease_expires=lease_expiry())
+    try:
+        ingestion_queue.submit(job_id)
+    except QueueFullError as e:
+        delete_document_record(file_id)
+        update_ingest_job(job_id, status='failed', error=str(e))
+        os.remove(upload_path)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {"message": f"File {file.filename} has been queued for indexing.", "job_id": job_id, "file_id": file_id}
+
+@app.post("/update-doc/{file_id}")
+def update_document(file_id: int, file: UploadFile = File(...)):
+    """
+    Replace an indexed document with a new version. Only chunks whose text
+    changed are embedded and added, vanished chunks are deleted and the
+    rest is kept; the response reports the three counts.
+    """
+    allowed_extensions = ['.pdf', '.docx', '.html']
+    file_extension = os.path.splitext(file.filename)[1].lower()
+
+    if file_extension not in allowed_extensions:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
+
+    document = get_document(file_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document with file_id {file_id} not found.")
+    if document['status'] != 'ready':
+        raise HTTPException(status_code=409, detail=f"Document with file_id {file_id} is still being indexed.")
+
+    upload_path, content_hash = save_upload(file.file, file_extension)
+    try:
+        if content_hash == document['content_hash']:
+            return {"message": f"File {file.filename} is unchanged.", "file_id": file_id,
+                    "kept": count_doc_chunks(file_id), "added": 0, "removed": 0}
+        existing = get_document_by_hash(content_hash)
+        if existing is not None:
+            raise HTTPException(status_code=409,
+                                detail=f"File {file.filename} is identical to already uploaded {existing['filename']} (file_id {existing['id']}).")
+
+        timings = {}
+        try:
+            counts = update_doc_in_chroma(upload_path, file_id, timings)
+        except Exception as e:
+            logging.error(f"Failed to update file_id {file_id}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to update {file.filename}: {e}")
+        try:
+            update_document_record(file_id, file.filename, content_hash)
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=409, detail=f"Concurrent upload of the same content as {file.filename}, please retry.")
+        logging.info(f"Updated file_id {file_id}: {counts} ({timings})")
+        return {"message": f"File {file.filename} has been re-indexed.", "file_id": file_id, **counts}
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        os.remove(upload_path)
+
+@app.get("/jobs/{job_id}", response_model=IngestJob)
+def get_job(job_id: str):
+    job = get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
+
+@app.get("/cache-stats")
+def cache_stats():
+    return {"answer_cache": answer_cache_stats(), "web_search_cache": web_cache.stats(),
+            "retrieval_cache": retrieval_cache.stats(), "query_embeddings": embedding_function.query_cache_stats() if embedding_function.ready else None,
+            "session_state": session_checkpointer.stats() if session_checkpointer else None,
+            "rag_checks": rag_check_totals, "coalescing": singleflight_stats(), "context_packer": packer_stats()}
+
+@app.get("/ready")
+def ready():
+    """200 once the start-up warm-up has finished; 503 with the steps still pending before that."""
+    if startup.STARTUP_WARMUP:
+        pending = startup.pending()
+        if pending:
+            return JSONResponse(status_code=503, content={"ready": False, "pending": pending})
+    return {"ready": True}
+
+@app.get("/startup-report")
+def startup_report():
+    """Import time per service module, build time of each lazy singleton and the warm-up timeline."""
+    return startup.report()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: request/span latency histograms and LLM token and cost counters."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/list-docs", response_model=list[DocumentInfo])
-def list_documents():
-    return get_all_documents()
+def list_documents(response: Response,
+                   limit: int = Query(LIST_DOCS_PAGE_SIZE, ge=1, le=LIST_DOCS_MAX_PAGE_SIZE),
+                   cursor: Optional[str] = None, filename: Optional[str] = None,
+                   uploaded_after: Optional[datetime] = None, uploaded_before: Optional[datetime] = None):
+    """
+    Ready documents, newest first, `limit` per page, optionally filtered by a
+    filename substring and upload time. When there are more, the
+    `X-Next-Cursor` header holds the `cursor` of the next page.
+    """
+    try:
+        documents, next_cursor = get_documents_page(limit, cursor, filename, uploaded_after, uploaded_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
 
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
+    # A running ingest job would keep adding chunks after the delete
+    document = get_document(request.file_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document with file_id {request.file_id} not found.")
+    if document['status'] != 'ready':
+        raise HTTPException(status_code=409, detail=f"Document with file_id {request.file_id} is still being indexed.")
+
     # Delete from Chroma
     chroma_delete_success = delete_doc_from_chroma(request.file_id)
 
@@ -109,3 +424,20 @@ def delete_document(request: DeleteFileRequest):
             return {"error": f"Deleted from Chroma but failed to delete document with file_id {request.file_id} from the database."}
     else:
         return {"error": f"Failed to delete document with file_id {request.file_id} from Chroma."}
+
+@app.post("/delete-docs")
+def delete_documents(request: DeleteFilesRequest):
+    """
+    Delete many documents: one Chroma delete filtered on `file_id`, then the
+    rows in one SQLite transaction. Documents still being indexed are skipped.
+    """
+    file_ids = list(dict.fromkeys(request.file_ids))
+    statuses = get_document_statuses(file_ids)
+    ready = [file_id for file_id in file_ids if statuses.get(file_id) == 'ready']
+    if ready:
+        if not delete_docs_from_chroma(ready):
+            raise HTTPException(status_code=500, detail="Failed to delete the documents from Chroma.")
+        delete_document_records(ready)
+    return {"deleted": ready,
+            "not_found": [file_id for file_id in file_ids if file_id not in statuses],
+            "indexing": [file_id for file_id in file_ids if statuses.get(file_id) not in (None, 'ready')]}
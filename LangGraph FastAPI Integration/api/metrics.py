@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from db_utils import insert_request_metrics, set_query_observer
+
+# ── Configuration ────────────────────────────────────────────────────
+# USD per 1M tokens as (input, output); model names match by prefix, so
+# dated snapshots like gpt-4.1-mini-2025-04-14 use their family's price.
+# LLM_PRICES='{"my-model": [1.0, 2.0]}' adds or overrides entries.
+LLM_PRICES = {
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    **{model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()},
+}
+# Skip the per-request rows in rag_app.db (Prometheus metrics are always kept)
+REQUEST_METRICS_STORE = os.getenv("REQUEST_METRICS_STORE", "true").lower() == "true"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+request_seconds = Histogram("rag_request_duration_seconds", "End-to-end chat request latency",
+                            ["endpoint", "route", "status"], buckets=BUCKETS)
+span_seconds = Histogram("rag_span_duration_seconds",
+                         "Latency of graph nodes, chains, LLM calls, tools, Chroma and SQLite calls",
+                         ["kind", "name"], buckets=BUCKETS)
+llm_calls = Counter("rag_llm_calls_total", "LLM calls", ["model", "node"])
+llm_tokens = Counter("rag_llm_tokens_total", "LLM tokens from response usage metadata", ["model", "direction"])
+llm_cost = Counter("rag_llm_cost_usd_total", "Estimated LLM cost in USD", ["model"])
+coalesced_calls = Counter("rag_coalesced_calls_total",
+                          "Calls answered from an identical in-flight call instead of running upstream", ["scope"])
+upstream_retries = Counter("rag_upstream_retries_total",
+                           "Retried OpenAI requests by upstream kind and status code or error", ["upstream", "reason"])
+rag_checks = Counter("rag_relevance_check_total",
+                     "rag_lookup decisions: accept/reject on the relevance score, or judge_llm", ["branch"])
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    prefix = max((p for p in LLM_PRICES if model.startswith(p)), key=len, default=None)
+    if prefix is None:
+        return 0.0
+    input_price, output_price = LLM_PRICES[prefix]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+context_tokens = Counter("rag_context_tokens_total",
+                         "Retrieved context tokens before and after the context packer", ["stage"])
+
+def record_context_pack(result, seconds: float):
+    """Record a `context_packer.PackResult`: Prometheus totals and a `packer` span with the token counts."""
+    context_tokens.labels("raw").inc(result.tokens_in)
+    context_tokens.labels("packed").inc(result.tokens_out)
+    observe_span("packer", "context", seconds, **result.summary())
+
+# Also kept in-process for /cache-stats
+rag_check_totals = {"accept": 0, "reject": 0, "judge": 0}
+
+def record_rag_check(branch: str):
+    rag_checks.labels(branch).inc()
+    rag_check_totals[branch] += 1
+
+# ── Per-request trace ────────────────────────────────────────────────
+class RequestTrace:
+    """Spans, token usage and the node path of one chat request."""
+
+    def __init__(self, endpoint: str, session_id: str):
+        self.request_id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.spans = []
+        self.nodes = []
+        self.route = None
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.token = None
+
+    def route_label(self) -> str:
+        return self.route or ">".join(self.nodes) or "none"
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+def observe_span(kind: str, name: str, seconds: float, trace: Optional[RequestTrace] = None, **extra):
+    """Record a span in Prometheus and in `trace` (default: the current request's trace)."""
+    span_seconds.labels(kind, name).observe(seconds)
+    trace = trace or current_trace.get()
+    if trace is not None:
+        trace.spans.append({"kind": kind, "name": name, "ms": round(seconds * 1000, 2),
+                            "at_ms": round((time.perf_counter() - trace.started) * 1000 - seconds * 1000, 2),
+                            **extra})
+
+@contextmanager
+def span(kind: str, name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(kind, name, time.perf_counter() - t0)
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(\w+)", re.IGNORECASE)
+
+def sql_label(statement: str) -> str:
+    """Low-cardinality label such as `SELECT chat_history`."""
+    verb = statement.split(None, 1)[0].upper() if statement.strip() else "?"
+    table = _SQL_TABLE.search(statement)
+    return f"{verb} {table.group(1)}" if table else verb
+
+set_query_observer(lambda statement, seconds: observe_span("sqlite", sql_label(statement), seconds))
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Times graph nodes, top-level chains, LLM calls and tools of one request
+    and collects LLM token usage from the response metadata.
+    """
+    # Called inline so timings and ordering are not skewed by a thread pool
+    run_inline = True
+
+    def __init__(self, trace: RequestTrace):
+        self.trace = trace
+        self._runs = {}
+        # chain run id -> name, to label LLM calls outside graph nodes
+        self._chains = {}
+
+    def _start(self, run_id, kind: str, name: str, **extra):
+        self._runs[run_id] = (kind, name, time.perf_counter(), extra)
+
+    def _end(self, run_id, **extra):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        kind, name, t0, start_extra = run
+        observe_span(kind, name, time.perf_counter() - t0, trace=self.trace, **{**start_extra, **extra})
+        return run
+
+    # ── Chains and graph nodes ──────────────────────────────────────
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "chain")
+        node = (metadata or {}).get("langgraph_node")
+        self._chains[run_id] = name
+        if node and name == node:
+            self._start(run_id, "node", node)
+        elif parent_run_id is None:
+            self._start(run_id, "chain", name)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._chains.pop(run_id, None)
+        run = self._end(run_id)
+        if run and run[0] == "node":
+            self.trace.nodes.append(run[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._chains.pop(run_id, None)
+        self._end(run_id, error=type(error).__name__)
+
+    # ── LLM calls ───────────────────────────────────────────────────
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "unknown"
+        node = (metadata or {}).get("langgraph_node") or self._chains.get(parent_run_id, "chain")
+        self._start(run_id, "llm", node, model=model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        model = run[3]["model"]
+        usage = {}
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        if message is not None and getattr(message, "usage_metadata", None):
+            usage = message.usage_metadata
+            model = message.response_metadata.get("model_name") or model
+        input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        cost = estimate_cost(model, input_tokens, output_tokens)
+
+        llm_calls.labels(model, run[1]).inc()
+        llm_tokens.labels(model, "input").inc(input_tokens)
+        llm_tokens.labels(model, "output").inc(output_tokens)
+        llm_cost.labels(model).inc(cost)
+        self.trace.llm_calls += 1
+        self.trace.input_tokens += input_tokens
+        self.trace.output_tokens += output_tokens
+        self.trace.cost_usd += cost
+        self._end(run_id, model=model, input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    # ── Tools ───────────────────────────────────────────────────────
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", kwargs.get("name") or (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+def start_request_trace(endpoint: str, session_id: str) -> RequestTrace:
+    """Start collecting spans for the current request (context-local)."""
+    trace = RequestTrace(endpoint, session_id)
+    trace.token = current_trace.set(trace)
+    return trace
+
+def traced_config(trace: RequestTrace, config: Optional[dict] = None) -> dict:
+    """Add the trace's callback handler to a runnable config."""
+    config = dict(config or {})
+    config["callbacks"] = [*config.get("callbacks", []), MetricsCallbackHandler(trace)]
+    return config
+
+def finish_request_trace(trace: RequestTrace, status: str = "ok"):
+    """Record the request in Prometheus and in the request_metrics table."""
+    total = time.perf_counter() - trace.started
+    route = trace.route_label()
+    request_seconds.labels(trace.endpoint, route, status).observe(total)
+    try:
+        current_trace.reset(trace.token)
+    except ValueError:
+        # Finished from a different context (e.g. a streaming generator)
+        current_trace.set(None)
+    if REQUEST_METRICS_STORE:
+        try:
+            insert_request_metrics(trace.request_id, trace.session_id, trace.endpoint, route, status,
+                                   round(total * 1000, 2), trace.llm_calls, trace.input_tokens,
+                                   trace.output_tokens, round(trace.cost_usd, 6), trace.spans)
+        except Exception as e:
+            logging.error(f"Failed to store request metrics: {e}")
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
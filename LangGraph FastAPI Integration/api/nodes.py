@@ -1,10 +1,36 @@
+import os
+import time
 from typing import Literal
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from shared import AgentState, router_llm, judge_llm, answer_llm, RouteDecision, RagJudge
-from tools import rag_search_tool, web_search_tool
+from tools import rag_search_tool, web_search_tool, split_web_results
+from metrics import record_rag_check, record_context_pack
+from context_packer import Passage, pack_context
+
+# Top relevance score at or above which the chunks are used without asking
+# judge_llm, and below which (or with no chunks) the web fallback is taken
+# directly. Scores in between go to the judge; RAG_ACCEPT_SCORE above 1
+# always asks the judge for a match.
+RAG_ACCEPT_SCORE = float(os.getenv("RAG_ACCEPT_SCORE", "0.80"))
+RAG_REJECT_SCORE = float(os.getenv("RAG_REJECT_SCORE", "0.35"))
+
+# Every node comes in two flavours: a sync one used by `agent.invoke` and an
+# async one (prefixed with `a`) used by `agent.ainvoke` / `agent.astream_events`.
+# The prompt building is shared so both paths stay identical.
+# Nodes return only the keys they change (see AgentState).
+# The async nodes also pick up an optional per-turn `Speculation`
+# (see speculation.py) from `config["configurable"]["speculation"]`.
+
+def get_speculation(config: RunnableConfig | None):
+    return ((config or {}).get("configurable") or {}).get("speculation")
+
+def last_human_content(state: AgentState) -> str:
+    return next((m.content for m in reversed(state["messages"])
+                 if isinstance(m, HumanMessage)), "")
 
 # ── Node 1: decision/router ─────────────────────────────────────────
-def router_node(state: AgentState) -> AgentState:
+def router_messages(state: AgentState) -> list:
     # Use full message history with a system prompt
     system_prompt = (
         "You are a router that decides how to handle user queries:\n"
@@ -12,23 +38,30 @@ def router_node(state: AgentState) -> AgentState:
         "- Use 'rag' when knowledge base lookup is needed\n"
         "- Use 'answer' when you can answer directly without external info"
     )
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    result: RouteDecision = router_llm.invoke(messages)
+    return [SystemMessage(content=system_prompt)] + state["messages"]
 
-    out = {"messages": state["messages"], "route": result.route}
+def route_update(state: AgentState, result: RouteDecision) -> AgentState:
+    out = {"route": result.route}
     if result.route == "end":
-        out["messages"] = state["messages"] + [AIMessage(content=result.reply or "Hello!")]
+        out["messages"] = [AIMessage(content=result.reply or "Hello!")]
     return out
 
-# ── Node 2: RAG lookup ───────────────────────────────────────────────
-def rag_node(state: AgentState) -> AgentState:
-    query = next((m.content for m in reversed(state["messages"])
-                  if isinstance(m, HumanMessage)), "")
+def planned_route(state: AgentState) -> RouteDecision | None:
+    # In planner mode the route was decided with the standalone question
+    return RouteDecision(**state["plan"]) if state.get("plan") else None
+
+def router_node(state: AgentState) -> AgentState:
+    result: RouteDecision = planned_route(state) or router_llm.invoke(router_messages(state))
+    return route_update(state, result)
 
-    chunks = rag_search_tool.invoke({"query": query})
+async def arouter_node(state: AgentState) -> AgentState:
+    result: RouteDecision = planned_route(state) or await router_llm.ainvoke(router_messages(state))
+    return route_update(state, result)
 
+# ── Node 2: RAG lookup ───────────────────────────────────────────────
+def judge_messages(query: str, chunks: str) -> list:
     # Use structured output to judge if RAG results are sufficient
-    judge_messages = [
+    return [
         ("system", (
             "You are a judge evaluating if the retrieved information is sufficient "
             "to answer the user's question. Consider both relevance and completeness."
@@ -36,31 +69,101 @@ def rag_node(state: AgentState) -> AgentState:
         ("user", f"Question: {query}\n\nRetrieved info: {chunks}\n\nIs this sufficient to answer the question?")
     ]
 
-    verdict: RagJudge = judge_llm.invoke(judge_messages)
-
+def rag_tool_call(query: str) -> dict:
+    # A tool call (rather than plain args) makes the tool return a
+    # ToolMessage whose artifact holds the relevance scores
+    return {"name": rag_search_tool.name, "args": {"query": query}, "id": "rag_lookup", "type": "tool_call"}
+
+def score_verdict(chunks: str, scores: list) -> Literal["accept", "reject", "judge"]:
+    """Decide on the top relevance score alone when it is clear-cut; "judge" asks judge_llm."""
+    if chunks.startswith("RAG_ERROR::") or not scores or scores[0] < RAG_REJECT_SCORE:
+        return "reject"
+    if scores[0] >= RAG_ACCEPT_SCORE:
+        return "accept"
+    return "judge"
+
+def rag_update(chunks: str, artifact: dict, check: str, sufficient: bool) -> AgentState:
+    record_rag_check(check)
     return {
-        **state,
         "rag": chunks,
-        "route": "answer" if verdict.sufficient else "web"
+        "rag_hits": [list(hit) for hit in zip(artifact.get("chunks", []), artifact["scores"])],
+        "rag_check": check,
+        "route": "answer" if sufficient else "web"
     }
 
+def rag_node(state: AgentState) -> AgentState:
+    query = last_human_content(state)
+    result = rag_search_tool.invoke(rag_tool_call(query))
+    chunks, artifact = result.content, result.artifact
+
+    check = score_verdict(chunks, artifact["scores"])
+    if check != "judge":
+        return rag_update(chunks, artifact, check, check == "accept")
+    verdict: RagJudge = judge_llm.invoke(judge_messages(query, chunks))
+    return rag_update(chunks, artifact, check, verdict.sufficient)
+
+async def arag_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    query = last_human_content(state)
+    speculation = get_speculation(config)
+
+    prefetched = await speculation.take_rag(query) if speculation else None
+    if prefetched is not None:
+        chunks, artifact = prefetched
+    else:
+        result = await rag_search_tool.ainvoke(rag_tool_call(query))
+        chunks, artifact = result.content, result.artifact
+
+    check = score_verdict(chunks, artifact["scores"])
+    if check != "judge":
+        return rag_update(chunks, artifact, check, check == "accept")
+
+    if speculation:
+        # Fire the web search now; it is cancelled if the judge is satisfied
+        speculation.start_web_prefetch(query)
+    verdict: RagJudge = await judge_llm.ainvoke(judge_messages(query, chunks))
+    if speculation and verdict.sufficient:
+        speculation.cancel_web()
+    return rag_update(chunks, artifact, check, verdict.sufficient)
+
 # ── Node 3: web search ───────────────────────────────────────────────
 def web_node(state: AgentState) -> AgentState:
-    query = next((m.content for m in reversed(state["messages"])
-                  if isinstance(m, HumanMessage)), "")
-    snippets = web_search_tool.invoke({"query": query})
-    return {**state, "web": snippets, "route": "answer"}
+    snippets = web_search_tool.invoke({"query": last_human_content(state)})
+    return {"web": snippets, "route": "answer"}
+
+async def aweb_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    query = last_human_content(state)
+    speculation = get_speculation(config)
+
+    snippets = await speculation.take_web(query) if speculation else None
+    if snippets is None:
+        snippets = await web_search_tool.ainvoke({"query": query})
+    return {"web": snippets, "route": "answer"}
 
 # ── Node 4: final answer ─────────────────────────────────────────────
-def answer_node(state: AgentState) -> AgentState:
-    user_q = next((m.content for m in reversed(state["messages"])
-                   if isinstance(m, HumanMessage)), "")
+def context_passages(state: AgentState) -> list:
+    passages = []
+    if state.get("rag_hits"):
+        passages += [Passage(text, "rag", score) for text, score in state["rag_hits"]]
+    elif state.get("rag") and not state["rag"].startswith("RAG_ERROR::"):
+        passages.append(Passage(state["rag"], "rag"))
+    if state.get("web") and not state["web"].startswith("WEB_ERROR::"):
+        passages += [Passage(snippet, "web") for snippet in split_web_results(state["web"])]
+    return passages
+
+def answer_messages(state: AgentState) -> list:
+    user_q = last_human_content(state)
+
+    # Overlapping chunks and duplicate snippets are trimmed and the rest is
+    # fitted into CONTEXT_TOKEN_BUDGET, chunks and web results taking turns
+    t0 = time.perf_counter()
+    packed = pack_context(context_passages(state))
+    record_context_pack(packed, time.perf_counter() - t0)
 
     ctx_parts = []
-    if state.get("rag"):
-        ctx_parts.append("Knowledge Base Information:\n" + state["rag"])
-    if state.get("web"):
-        ctx_parts.append("Web Search Results:\n" + state["web"])
+    if packed.text("rag"):
+        ctx_parts.append("Knowledge Base Information:\n" + packed.text("rag"))
+    if packed.text("web"):
+        ctx_parts.append("Web Search Results:\n" + packed.text("web"))
 
     context = "\n\n".join(ctx_parts) if ctx_parts else "No external context available."
 
@@ -72,10 +175,12 @@ Context:
 {context}
 
 Provide a helpful, accurate, and concise response based on the available information."""
-    messages = state["messages"] + [HumanMessage(content=prompt)]
-    ans = answer_llm.invoke(messages).content
+    return state["messages"] + [HumanMessage(content=prompt)]
 
-    return {
-        **state,
-        "messages": state["messages"] + [AIMessage(content=ans)]
-    }
\ No newline at end of file
+def answer_node(state: AgentState) -> AgentState:
+    ans = answer_llm.invoke(answer_messages(state)).content
+    return {"messages": [AIMessage(content=ans)]}
+
+async def aanswer_node(state: AgentState) -> AgentState:
+    ans = (await answer_llm.ainvoke(answer_messages(state))).content
+    return {"messages": [AIMessage(content=ans)]}
\ No newline at end of file
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+from pypdf import PdfReader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# This module is imported by the worker processes, so it deliberately
+# avoids the embedding model, Chroma and the database.
+
+# PARALLEL_LOAD_WORKERS=0 keeps the single-process loader
+PARALLEL_LOAD_WORKERS = int(os.getenv("PARALLEL_LOAD_WORKERS", "0"))
+# PDFs with fewer pages than this use the single-process loader
+PARALLEL_LOAD_MIN_PAGES = int(os.getenv("PARALLEL_LOAD_MIN_PAGES", "20"))
+PARALLEL_LOAD_PAGES_PER_TASK = int(os.getenv("PARALLEL_LOAD_PAGES_PER_TASK", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the API process runs threads
+            _executor = ProcessPoolExecutor(max_workers=PARALLEL_LOAD_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def pdf_page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+def use_parallel_loader(file_path: str) -> bool:
+    return (PARALLEL_LOAD_WORKERS > 0
+            and file_path.endswith('.pdf')
+            and pdf_page_count(file_path) >= PARALLEL_LOAD_MIN_PAGES)
+
+def load_and_split_pages(file_path: str, start: int, end: int,
+                         chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Worker task: extract pages [start, end) and split them like PyPDFLoader + the splitter would."""
+    reader = PdfReader(file_path)
+    pages = [Document(page_content=reader.pages[i].extract_text(),
+                      metadata={"source": file_path, "page": i})
+             for i in range(start, end)]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    return splitter.split_documents(pages)
+
+def iter_pdf_split_batches(file_path: str, chunk_size: int, chunk_overlap: int) -> Iterator[List[Document]]:
+    """
+    Fan page ranges out to the process pool and yield the split batches in
+    page order as soon as each one is ready, so the caller can start
+    embedding before the whole file has been parsed.
+    """
+    page_count = pdf_page_count(file_path)
+    executor = get_executor()
+    futures = [
+        executor.submit(load_and_split_pages, file_path, start,
+                        min(start + PARALLEL_LOAD_PAGES_PER_TASK, page_count),
+                        chunk_size, chunk_overlap)
+        for start in range(0, page_count, PARALLEL_LOAD_PAGES_PER_TASK)
+    ]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
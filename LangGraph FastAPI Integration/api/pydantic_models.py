@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
+from typing import List, Optional
 
 class ModelName(str, Enum):
     GPT4_1 = "gpt-4.1"
@@ -22,4 +23,20 @@ class DocumentInfo(BaseModel):
     upload_timestamp: datetime
 
 class DeleteFileRequest(BaseModel):
-    file_id: int
\ No newline at end of file
+    file_id: int
+
+class DeleteFilesRequest(BaseModel):
+    file_ids: List[int] = Field(min_length=1, max_length=500)
+
+class IngestJob(BaseModel):
+    id: str
+    filename: str
+    file_id: Optional[int] = None
+    status: str
+    stage: str
+    chunks_total: int
+    chunks_embedded: int
+    timings: dict[str, float]
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
\ No newline at end of file
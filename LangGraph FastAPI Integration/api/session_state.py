@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+import aiosqlite
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (BaseCheckpointSaver, ChannelVersions, Checkpoint,
+                                       CheckpointMetadata, CheckpointTuple, copy_checkpoint)
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+# ── Configuration ────────────────────────────────────────────────────
+# "checkpointer" keeps each session's graph state in a LangGraph checkpointer;
+# "history" rebuilds the messages from chat_history on every turn
+SESSION_STATE_BACKEND = os.getenv("SESSION_STATE_BACKEND", "checkpointer").lower()
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "checkpoints.db")
+# Bounds of the in-memory LRU of hot sessions; the oldest sessions are
+# evicted first and reload from SQLite on their next turn
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1000"))
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "256"))
+
+class LRUCheckpointer(BaseCheckpointSaver):
+    """
+    Checkpointer persisting to SQLite through `AsyncSqliteSaver` (and a
+    `SqliteSaver` on the same file for the sync graph API), with the latest
+    checkpoint of recently active sessions kept in memory.
+
+    Reads of a hot session's latest checkpoint never touch SQLite; every
+    write goes through to SQLite before the cache is updated, so an evicted
+    or restarted session resumes from disk. Size is tracked as the
+    serialised checkpoint bytes.
+    """
+
+    def __init__(self, db_path: str = CHECKPOINT_DB_PATH, max_sessions: int = SESSION_CACHE_MAX_SESSIONS,
+                 max_bytes: int = int(SESSION_CACHE_MAX_MB * 1024 * 1024)):
+        super().__init__()
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.saver: Optional[AsyncSqliteSaver] = None
+        self._conn = None
+        self._sync_saver: Optional[SqliteSaver] = None
+        self._lock = threading.Lock()
+        # (thread_id, checkpoint_ns) -> (CheckpointTuple, size in bytes)
+        self._hot: "OrderedDict[tuple, tuple[CheckpointTuple, int]]" = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    # ── Lifecycle ───────────────────────────────────────────────────
+    async def open(self):
+        if self.saver is None:
+            self._conn = await aiosqlite.connect(self.db_path)
+            self.saver = AsyncSqliteSaver(self._conn, serde=self.serde)
+            await self.saver.setup()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+            self.saver = None
+        with self._lock:
+            if self._sync_saver is not None:
+                self._sync_saver.conn.close()
+                self._sync_saver = None
+
+    def sync_saver(self) -> SqliteSaver:
+        """SqliteSaver for `agent.invoke`; opened on first sync use."""
+        with self._lock:
+            if self._sync_saver is None:
+                saver = SqliteSaver(sqlite3.connect(self.db_path, check_same_thread=False), serde=self.serde)
+                saver.setup()
+                self._sync_saver = saver
+            return self._sync_saver
+
+    # ── LRU ─────────────────────────────────────────────────────────
+    @staticmethod
+    def _key(config: RunnableConfig) -> tuple:
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    def _cached(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+        with self._lock:
+            item = self._hot.get(self._key(config))
+            if item is None or (checkpoint_id and checkpoint_id != item[0].checkpoint["id"]):
+                self._stats["misses"] += 1
+                return None
+            self._hot.move_to_end(self._key(config))
+            self._stats["hits"] += 1
+            saved = item[0]
+        # The graph updates channel versions in place; hand out a copy
+        return saved._replace(checkpoint=copy_checkpoint(saved.checkpoint))
+
+    def _remember(self, saved: CheckpointTuple):
+        size = len(self.serde.dumps_typed(saved.checkpoint)[1])
+        key = self._key(saved.config)
+        with self._lock:
+            self._forget_locked(key)
+            self._hot[key] = (saved, size)
+            self._bytes += size
+            while self._hot and (len(self._hot) > self.max_sessions or self._bytes > self.max_bytes):
+                _, (_, old_size) = self._hot.popitem(last=False)
+                self._bytes -= old_size
+                self._stats["evictions"] += 1
+
+    def _forget_locked(self, key: tuple):
+        item = self._hot.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def forget(self, config: RunnableConfig):
+        with self._lock:
+            self._forget_locked(self._key(config))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "sessions": len(self._hot),
+                "memory_bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+    def _loaded(self, config: RunnableConfig, saved: Optional[CheckpointTuple]) -> Optional[CheckpointTuple]:
+        """Cache a latest checkpoint read from SQLite."""
+        if saved is not None and not saved.pending_writes and not config["configurable"].get("checkpoint_id"):
+            self._remember(saved)
+            saved = saved._replace(checkpoint=copy_checkpoint(saved.checkpoint))
+        return saved
+
+    def _stored(self, config: RunnableConfig, next_config: RunnableConfig, checkpoint: Checkpoint,
+                metadata: CheckpointMetadata):
+        """Cache a checkpoint just written to SQLite."""
+        parent_id = config["configurable"].get("checkpoint_id")
+        parent_config = ({"configurable": {**next_config["configurable"], "checkpoint_id": parent_id}}
+                         if parent_id else None)
+        self._remember(CheckpointTuple(next_config, copy_checkpoint(checkpoint), metadata, parent_config, []))
+        with self._lock:
+            self._stats["puts"] += 1
+
+    # ── BaseCheckpointSaver (async) ─────────────────────────────────
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        saved = self._cached(config)
+        if saved is not None:
+            return saved
+        return self._loaded(config, await self.saver.aget_tuple(config))
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        next_config = await self.saver.aput(config, checkpoint, metadata, new_versions)
+        self._stored(config, next_config, checkpoint, metadata)
+        return next_config
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]],
+                          task_id: str, task_path: str = "") -> None:
+        # Pending writes only matter when resuming an interrupted step; let
+        # that rare path read them from SQLite
+        self.forget(config)
+        await self.saver.aput_writes(config, writes, task_id, task_path)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs) -> AsyncIterator[CheckpointTuple]:
+        async for saved in self.saver.alist(config, **kwargs):
+            yield saved
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                self._forget_locked(key)
+        await self.saver.adelete_thread(thread_id)
+
+    def get_next_version(self, current, channel):
+        # Stateless, so it works before open() (e.g. when drawing the graph)
+        return SqliteSaver.get_next_version(self, current, channel)
+
+    # ── BaseCheckpointSaver (sync) ──────────────────────────────────
+    # Used by `agent.invoke`; same cache, SQLite through a SqliteSaver.
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        saved = self._cached(config)
+        if saved is not None:
+            return saved
+        return self._loaded(config, self.sync_saver().get_tuple(config))
+
+    def list(self, config: Optional[RunnableConfig], **kwargs) -> Iterator[CheckpointTuple]:
+        yield from self.sync_saver().list(config, **kwargs)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint,
+            metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        next_config = self.sync_saver().put(config, checkpoint, metadata, new_versions)
+        self._stored(config, next_config, checkpoint, metadata)
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]],
+                   task_id: str, task_path: str = "") -> None:
+        self.forget(config)
+        self.sync_saver().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                self._forget_locked(key)
+        self.sync_saver().delete_thread(thread_id)
+
+session_checkpointer = LRUCheckpointer() if SESSION_STATE_BACKEND == "checkpointer" else None
+
+def session_config(session_id: str, config: Optional[dict] = None) -> dict:
+    """Add the session's thread id to a per-turn agent config."""
+    config = dict(config or {})
+    if session_checkpointer:
+        config["configurable"] = {**config.get("configurable", {}), "thread_id": session_id}
+    return config
@@ -1,7 +1,9 @@
-from typing import TypedDict, List, Literal
+from typing import TypedDict, List, Literal, Annotated
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage
+from langgraph.graph.message import add_messages
+from http_clients import openai_client_kwargs
+from startup import Lazy
 
 # ── Pydantic schemas ─────────────────────────────────────────────────
 class RouteDecision(BaseModel):
@@ -11,16 +13,40 @@ class RouteDecision(BaseModel):
 class RagJudge(BaseModel):
     sufficient: bool
 
+class TurnPlan(BaseModel):
+    """Planner mode: contextualisation and routing in one call."""
+    standalone_question: str = Field(description="The latest user message rewritten to be understood without the chat history")
+    route: Literal["rag", "answer", "end"]
+    reply: str | None = Field(None, description="Filled only when route == 'end'")
+
 # ── LLM instances with structured output where needed ───────────────
-router_llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0)\
-             .with_structured_output(RouteDecision)
-judge_llm  = ChatOpenAI(model="gpt-4.1-mini", temperature=0)\
-             .with_structured_output(RagJudge)
-answer_llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
+def chat_model(**kwargs):
+    """ChatOpenAI on the shared pooled HTTP client (see http_clients.py)."""
+    # langchain_openai takes over a second to import; it is only paid when
+    # the first model is built (see startup.py)
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(**kwargs, **openai_client_kwargs())
+
+router_llm = Lazy("router_llm", lambda: chat_model(model="gpt-4.1-mini", temperature=0)
+                  .with_structured_output(RouteDecision))
+judge_llm = Lazy("judge_llm", lambda: chat_model(model="gpt-4.1-mini", temperature=0)
+                 .with_structured_output(RagJudge))
+planner_llm = Lazy("planner_llm", lambda: chat_model(model="gpt-4.1-mini", temperature=0)
+                   .with_structured_output(TurnPlan))
+# stream_usage reports token usage for streamed answers too (see metrics.py)
+answer_llm = Lazy("answer_llm", lambda: chat_model(model="gpt-4.1-mini", temperature=0.7, stream_usage=True))
 
 # ── Shared state type ────────────────────────────────────────────────
+# Nodes return only the messages they add; add_messages appends them, so a
+# checkpointed session only ever receives the new turn.
 class AgentState(TypedDict, total=False):
-    messages: List[BaseMessage]
+    messages: Annotated[List[BaseMessage], add_messages]
     route:    Literal["rag", "answer", "end"]
     rag:      str
-    web:      str 
\ No newline at end of file
+    # [chunk text, relevance score] pairs behind `rag`, for the context packer
+    rag_hits: List[list]
+    # How rag_lookup decided: "accept"/"reject" on the relevance score or "judge"
+    rag_check: Literal["accept", "reject", "judge"]
+    web:      str
+    # Planner mode: {"route", "reply"} decided together with the standalone question
+    plan:     dict | None 
\ No newline at end of file
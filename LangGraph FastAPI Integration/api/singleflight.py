@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable, Dict, List, TypeVar
+from langchain_core.messages import BaseMessage
+from metrics import coalesced_calls
+
+# Concurrent identical work (same agent turn, same retrieval or web query)
+# runs once and the result is shared with every caller waiting for it.
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+# A waiting caller gives up after this many seconds and runs the work itself
+SINGLEFLIGHT_MAX_WAIT = float(os.getenv("SINGLEFLIGHT_MAX_WAIT", "30"))
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls with the same key onto one in-flight
+    call. Followers get the leader's result (or exception); if the leader
+    is cancelled, or it takes longer than `max_wait`, they run the call
+    themselves.
+    """
+
+    def __init__(self, scope: str, max_wait: float = SINGLEFLIGHT_MAX_WAIT, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.scope = scope
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"leader_calls": 0, "saved_calls": 0, "timeouts": 0, "leader_cancelled": 0}
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await call()
+
+        future = self._inflight.get(key)
+        if future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                return await call()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                self.stats["leader_cancelled"] += 1
+                return await call()
+            self.stats["saved_calls"] += 1
+            coalesced_calls.labels(self.scope).inc()
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.stats["leader_calls"] += 1
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved so a leader without followers logs no warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._inflight), "enabled": self.enabled}
+
+def history_fingerprint(messages: List[BaseMessage]) -> str:
+    """Hash of the history a turn is answered against; equal hashes are safe to share."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+agent_flight = SingleFlight("agent")
+rag_flight = SingleFlight("rag_search")
+web_flight = SingleFlight("web_search")
+
+def singleflight_stats() -> dict:
+    return {flight.scope: flight.snapshot() for flight in (agent_flight, rag_flight, web_flight)}
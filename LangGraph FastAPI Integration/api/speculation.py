@@ -0,0 +1,161 @@
+import asyncio
+import difflib
+import logging
+import os
+import time
+from typing import Optional
+from tools import arag_search, aweb_search
+from utils import normalize_question
+
+# ── Configuration ────────────────────────────────────────────────────
+# SPECULATIVE_MODE=true starts retrieval on the raw question while the
+# question is contextualised and routed, and starts the web search while
+# the judge is still deciding whether the RAG context is sufficient.
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "false").lower() == "true"
+# Minimum similarity between the raw and the rewritten question for the
+# prefetched chunks to be reused.
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv("SPECULATIVE_MATCH_THRESHOLD", "0.9"))
+
+# Process-wide totals, aggregated from the per-turn counters
+speculation_totals = {
+    "turns": 0,
+    "rag_prefetch_hits": 0,
+    "rag_prefetch_misses": 0,
+    "rag_saved_ms": 0.0,
+    "web_prefetch_used": 0,
+    "web_prefetch_cancelled": 0,
+    "web_saved_ms": 0.0,
+    "web_wasted_ms": 0.0,
+}
+
+def question_similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, normalize_question(a), normalize_question(b)).ratio()
+
+async def _timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - start) * 1000
+
+class Speculation:
+    """
+    Speculative work for a single chat turn.
+
+    Created by `main.py` before contextualisation and handed to the async
+    nodes through `config["configurable"]["speculation"]`.
+    """
+
+    def __init__(self, raw_question: str):
+        self.raw_question = raw_question
+        self._rag_task: Optional[asyncio.Task] = None
+        self._web_task: Optional[asyncio.Task] = None
+        self._web_query = None
+        self._web_started = 0.0
+        self._closed = False
+        self.stats = {
+            "rag_prefetch": "off",
+            "rag_similarity": None,
+            "rag_saved_ms": 0.0,
+            "web_prefetch": "off",
+            "web_saved_ms": 0.0,
+            "web_wasted_ms": 0.0,
+        }
+
+    # ── Chroma retrieval on the raw question ────────────────────────
+    def start_rag_prefetch(self):
+        self._rag_task = asyncio.create_task(_timed(arag_search(self.raw_question)))
+        self.stats["rag_prefetch"] = "pending"
+
+    async def take_rag(self, query: str) -> Optional[tuple[str, dict]]:
+        """Return the prefetched (chunks, scores artifact) if `query` is close enough to the raw question."""
+        if self._rag_task is None:
+            return None
+        task, self._rag_task = self._rag_task, None
+
+        similarity = question_similarity(self.raw_question, query)
+        self.stats["rag_similarity"] = round(similarity, 3)
+        if similarity < SPECULATIVE_MATCH_THRESHOLD:
+            task.cancel()
+            self.stats["rag_prefetch"] = "miss"
+            return None
+
+        wait_start = time.perf_counter()
+        result, elapsed_ms = await task
+        waited_ms = (time.perf_counter() - wait_start) * 1000
+        if result[0].startswith("RAG_ERROR::"):
+            self.stats["rag_prefetch"] = "error"
+            return None
+
+        self.stats["rag_prefetch"] = "hit"
+        self.stats["rag_saved_ms"] = round(max(elapsed_ms - waited_ms, 0.0), 1)
+        return result
+
+    # ── Tavily search in parallel with the judge ────────────────────
+    def start_web_prefetch(self, query: str):
+        self._web_query = query
+        self._web_started = time.perf_counter()
+        self._web_task = asyncio.create_task(_timed(aweb_search(query)))
+        self.stats["web_prefetch"] = "pending"
+
+    def cancel_web(self):
+        if self._web_task is None:
+            return
+        task, self._web_task = self._web_task, None
+        if not task.done():
+            task.cancel()
+        self.stats["web_prefetch"] = "cancelled"
+        self.stats["web_wasted_ms"] = round((time.perf_counter() - self._web_started) * 1000, 1)
+
+    async def take_web(self, query: str) -> Optional[str]:
+        if self._web_task is None or query != self._web_query:
+            return None
+        task, self._web_task = self._web_task, None
+
+        wait_start = time.perf_counter()
+        snippets, elapsed_ms = await task
+        waited_ms = (time.perf_counter() - wait_start) * 1000
+        self.stats["web_prefetch"] = "used"
+        self.stats["web_saved_ms"] = round(max(elapsed_ms - waited_ms, 0.0), 1)
+        return snippets
+
+    def close(self) -> dict:
+        """Cancel leftover speculative work, fold the counters into the totals and return them."""
+        if self._closed:
+            return self.stats
+        self._closed = True
+        if self._rag_task is not None:
+            self._rag_task.cancel()
+            self._rag_task = None
+            self.stats["rag_prefetch"] = "unused"
+        if self._web_task is not None:
+            self.cancel_web()
+
+        speculation_totals["turns"] += 1
+        if self.stats["rag_prefetch"] == "hit":
+            speculation_totals["rag_prefetch_hits"] += 1
+        elif self.stats["rag_prefetch"] in ("miss", "error"):
+            speculation_totals["rag_prefetch_misses"] += 1
+        if self.stats["web_prefetch"] == "used":
+            speculation_totals["web_prefetch_used"] += 1
+        elif self.stats["web_prefetch"] == "cancelled":
+            speculation_totals["web_prefetch_cancelled"] += 1
+        speculation_totals["rag_saved_ms"] += self.stats["rag_saved_ms"]
+        speculation_totals["web_saved_ms"] += self.stats["web_saved_ms"]
+        speculation_totals["web_wasted_ms"] += self.stats["web_wasted_ms"]
+        return self.stats
+
+def start_speculation(raw_question: str) -> Optional[Speculation]:
+    """Kick off speculative retrieval when SPECULATIVE_MODE is enabled."""
+    if not SPECULATIVE_MODE:
+        return None
+    speculation = Speculation(raw_question)
+    speculation.start_rag_prefetch()
+    return speculation
+
+def agent_config(speculation: Optional[Speculation]) -> dict:
+    return {"configurable": {"speculation": speculation}} if speculation else {}
+
+def finish_speculation(speculation: Optional[Speculation], session_id: str):
+    if speculation is None:
+        return
+    stats = speculation.close()
+    logging.info(f"Session ID: {session_id}, Speculation: {stats}")
@@ -0,0 +1,167 @@
+# Cold-start support: per-module import timing, lazily built singletons and
+# an optional background warm-up. Import this module before any other
+# service module (main.py does it first) so the imports that follow are
+# timed. Expensive objects (model clients, the Chroma store, the compiled
+# graph) are declared as `Lazy` and built on first use or by `warm_up()`.
+import importlib.abc
+import importlib.machinery
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# Build every Lazy singleton in the background as soon as the app starts;
+# when false they are built by the first request that needs them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+STARTUP_WARMUP_WORKERS = int(os.getenv("STARTUP_WARMUP_WORKERS", "4"))
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_imports: Dict[str, dict] = {}
+_inits: Dict[str, dict] = {}
+_steps: List[tuple] = []
+_warmup = {"enabled": STARTUP_WARMUP, "started_ms": None, "finished_ms": None, "errors": {}}
+
+def _since_start_ms() -> float:
+    return round((time.perf_counter() - STARTED) * 1000, 2)
+
+# ── Import timing ────────────────────────────────────────────────────
+_import_stack = threading.local()
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a service module's loader to time its execution."""
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = _import_stack.__dict__.setdefault("frames", [])
+        stack.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - t0
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+            with _lock:
+                # `self_ms` leaves out the other service modules it imported
+                # (third-party imports are included)
+                _imports[self._name] = {"total_ms": round(total * 1000, 2),
+                                        "self_ms": round((total - nested) * 1000, 2)}
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        if "." in fullname:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or not spec.origin or os.path.dirname(os.path.abspath(spec.origin)) != SERVICE_DIR:
+            return None
+        spec.loader = _TimedLoader(spec.loader, fullname)
+        return spec
+
+if not any(isinstance(finder, _ImportTimer) for finder in sys.meta_path):
+    sys.meta_path.insert(0, _ImportTimer())
+
+# ── Lazy singletons ──────────────────────────────────────────────────
+_UNSET = object()
+
+def _record_init(name: str, seconds: float, error: Optional[str] = None):
+    with _lock:
+        _inits[name] = {"ms": round(seconds * 1000, 2), "at_ms": _since_start_ms(),
+                        "thread": threading.current_thread().name, **({"error": error} if error else {})}
+
+class Lazy:
+    """
+    Thread-safe singleton built by `factory` on first use. Attribute access
+    is forwarded to the built object, so a module-level
+    `vectorstore = Lazy("chroma", build)` is used like the object itself;
+    `instance()` returns the object (e.g. to compose it into a chain);
+    it is not called `get` so it cannot shadow the object's own `get`.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._value = _UNSET
+        self._build_lock = threading.Lock()
+        register_warmup(name, self.instance)
+
+    def instance(self):
+        if self._value is _UNSET:
+            with self._build_lock:
+                if self._value is _UNSET:
+                    t0 = time.perf_counter()
+                    try:
+                        value = self._factory()
+                    except Exception as e:
+                        _record_init(self._name, time.perf_counter() - t0, error=str(e))
+                        raise
+                    _record_init(self._name, time.perf_counter() - t0)
+                    self._value = value
+        return self._value
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not _UNSET
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+    def __repr__(self):
+        return f"Lazy({self._name!r}, ready={self.ready})"
+
+def register_warmup(name: str, step: Callable[[], Any]):
+    """Add a step to `warm_up()`; Lazy singletons register themselves."""
+    with _lock:
+        _steps.append((name, step))
+
+def warm_up():
+    """Run every registered step (in a small thread pool); failures are recorded, not raised."""
+    with _lock:
+        _warmup["started_ms"] = _since_start_ms()
+        steps = list(_steps)
+
+    def run(name, step):
+        try:
+            t0 = time.perf_counter()
+            step()
+            if name not in _inits:
+                _record_init(name, time.perf_counter() - t0)
+        except Exception as e:
+            logging.error(f"Warm-up of {name} failed: {e}")
+            with _lock:
+                _warmup["errors"][name] = str(e)
+
+    with ThreadPoolExecutor(max_workers=STARTUP_WARMUP_WORKERS, thread_name_prefix="warmup") as pool:
+        for name, step in steps:
+            pool.submit(run, name, step)
+    with _lock:
+        _warmup["finished_ms"] = _since_start_ms()
+    logging.info(f"Startup report: {report()}")
+
+def pending() -> List[str]:
+    """Registered steps that have not completed (or have failed)."""
+    with _lock:
+        return [name for name, _ in _steps if name not in _inits or "error" in _inits[name]]
+
+def report() -> dict:
+    with _lock:
+        imports = dict(sorted(_imports.items(), key=lambda item: -item[1]["self_ms"]))
+        return {
+            "imports": imports,
+            "imports_total_ms": round(sum(i["self_ms"] for i in imports.values()), 2),
+            "init": dict(sorted(_inits.items(), key=lambda item: -item[1]["ms"])),
+            "warmup": {**_warmup, "errors": dict(_warmup["errors"])},
+            "uptime_ms": _since_start_ms(),
+        }
@@ -1,40 +1,176 @@
-from langchain_tavily import TavilySearch
-from langchain_core.tools import tool
-from chroma_utils import vectorstore
+from langchain_core.tools import StructuredTool
+from chroma_utils import vectorstore, embedding_function, collection_space
+from db_utils import get_index_version
+from ttl_cache import TTLCache
+from utils import normalize_question
+from metrics import span
+from singleflight import rag_flight, web_flight
+from startup import Lazy
+from array import array
+import asyncio
+import hashlib
+import math
 import os
+import re
 
-# Initialize Tavily search
-tavily = TavilySearch(max_results=3, topic="general")
+def build_tavily():
+    from langchain_tavily import TavilySearch
+    return TavilySearch(max_results=3, topic="general")
 
-# Create retriever from vectorstore
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+# Initialize Tavily search on first use
+tavily = Lazy("tavily", build_tavily)
 
-@tool
-def web_search_tool(query: str) -> str:
-    """Up-to-date web info via Tavily"""
+# Cache of formatted Tavily results keyed by the normalised query.
+# WEB_CACHE_PATH enables on-disk persistence; WEB_ERROR results are
+# cached only briefly so a transient outage is not hammered.
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", "900"))
+WEB_CACHE_ERROR_TTL = float(os.getenv("WEB_CACHE_ERROR_TTL", "30"))
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "2000"))
+WEB_CACHE_PATH = os.getenv("WEB_CACHE_PATH") or None
+
+web_cache = TTLCache(WEB_CACHE_MAX_ENTRIES, WEB_CACHE_TTL,
+                     persist_path=WEB_CACHE_PATH, table="web_search_cache")
+
+# Number of chunks returned by rag_search_tool
+RAG_TOP_K = 3
+
+# Retrieved (chunk, relevance score) lists keyed by (query embedding hash, k,
+# index version). Query embeddings themselves are cached by
+# CachedEmbeddings. Indexing or deleting a document bumps the index version,
+# so results from an older collection are never served; they just age out.
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2000"))
+
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL)
+
+def format_web_results(result) -> str:
+    """Extract and format the results from a Tavily response."""
+    if isinstance(result, dict) and 'results' in result:
+        formatted_results = []
+        for item in result['results']:
+            title = item.get('title', 'No title')
+            content = item.get('content', 'No content')
+            url = item.get('url', '')
+            formatted_results.append(f"Title: {title}\nContent: {content}\nURL: {url}")
+
+        return "\n\n".join(formatted_results) if formatted_results else "No results found"
+    else:
+        return str(result)
+
+def web_cache_ttl(snippets: str) -> float:
+    return WEB_CACHE_ERROR_TTL if snippets.startswith("WEB_ERROR::") else WEB_CACHE_TTL
+
+def web_search(query: str) -> str:
+    key = normalize_question(query)
+    cached = web_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        result = tavily.invoke({"query": query})
-
-        # Extract and format the results from Tavily response
-        if isinstance(result, dict) and 'results' in result:
-            formatted_results = []
-            for item in result['results']:
-                title = item.get('title', 'No title')
-                content = item.get('content', 'No content')
-                url = item.get('url', '')
-                formatted_results.append(f"Title: {title}\nContent: {content}\nURL: {url}")
-
-            return "\n\n".join(formatted_results) if formatted_results else "No results found"
-        else:
-            return str(result)
+        with span("http", "tavily"):
+            snippets = format_web_results(tavily.invoke({"query": query}))
     except Exception as e:
-        return f"WEB_ERROR::{e}"
+        snippets = f"WEB_ERROR::{e}"
+    web_cache.set(key, snippets, ttl=web_cache_ttl(snippets))
+    return snippets
+
+async def aweb_search(query: str) -> str:
+    key = normalize_question(query)
+    cached = web_cache.get(key)
+    if cached is not None:
+        return cached
+    # Concurrent misses for the same query share one Tavily call
+    return await web_flight.do(key, lambda: _aweb_search(query, key))
 
-@tool
-def rag_search_tool(query: str) -> str:
-    """Top-3 chunks from KB (empty string if none)"""
+async def _aweb_search(query: str, key: str) -> str:
     try:
-        docs = retriever.invoke(query)
-        return "\n\n".join(d.page_content for d in docs) if docs else ""
+        with span("http", "tavily"):
+            snippets = format_web_results(await tavily.ainvoke({"query": query}))
     except Exception as e:
-        return f"RAG_ERROR::{e}"
\ No newline at end of file
+        snippets = f"WEB_ERROR::{e}"
+    if web_cache.persist_path:
+        await asyncio.to_thread(web_cache.set, key, snippets, web_cache_ttl(snippets))
+    else:
+        web_cache.set(key, snippets, ttl=web_cache_ttl(snippets))
+    return snippets
+
+def split_web_results(snippets: str) -> list:
+    """The per-result blocks of `format_web_results` output."""
+    return re.split(r"\n\n(?=Title: )", snippets)
+
+def format_rag_results(hits: list) -> tuple[str, dict]:
+    """
+    (joined chunks, {"scores": relevance scores, best first, "chunks": the
+    chunk texts}) as returned by the RAG tool.
+    """
+    chunks = "\n\n".join(text for text, _ in hits)
+    return chunks, {"scores": [round(score, 4) for _, score in hits], "chunks": [text for text, _ in hits]}
+
+def retrieval_key(embedding: list, k: int, index_version: int) -> str:
+    digest = hashlib.sha256(array("f", embedding).tobytes()).hexdigest()[:32]
+    return f"{digest}:{k}:{index_version}"
+
+def distance_to_relevance(distance: float, space: str) -> float:
+    """
+    Relevance score (higher is more similar, 1 for an exact match) of a Chroma
+    distance; the same conversion similarity_search_with_relevance_scores applies.
+    """
+    if space == "cosine":
+        return 1.0 - distance
+    if space == "ip":
+        return 1.0 - distance if distance > 0 else -distance
+    # l2 between unit-length embeddings
+    return 1.0 - distance / math.sqrt(2)
+
+def search_by_vector(embedding: list, k: int) -> list:
+    """Query Chroma with a precomputed embedding; returns [chunk text, relevance score] pairs."""
+    space = collection_space()
+    with span("chroma", "similarity_search"):
+        docs = vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+    return [[d.page_content, distance_to_relevance(distance, space)] for d, distance in docs]
+
+def rag_search(query: str) -> tuple[str, dict]:
+    try:
+        embedding = embedding_function.embed_query(query)
+        key = retrieval_key(embedding, RAG_TOP_K, get_index_version())
+        hits = retrieval_cache.get(key)
+        if hits is None:
+            hits = search_by_vector(embedding, RAG_TOP_K)
+            retrieval_cache.set(key, hits)
+        return format_rag_results(hits)
+    except Exception as e:
+        return f"RAG_ERROR::{e}", {"scores": [], "chunks": []}
+
+async def arag_search(query: str) -> tuple[str, dict]:
+    # Concurrent searches for the same query share one embedding + Chroma call
+    return await rag_flight.do(query, lambda: _arag_search(query))
+
+async def _arag_search(query: str) -> tuple[str, dict]:
+    try:
+        embedding = await embedding_function.aembed_query(query)
+        key = retrieval_key(embedding, RAG_TOP_K, await asyncio.to_thread(get_index_version))
+        hits = retrieval_cache.get(key)
+        if hits is None:
+            hits = await asyncio.to_thread(search_by_vector, embedding, RAG_TOP_K)
+            retrieval_cache.set(key, hits)
+        return format_rag_results(hits)
+    except Exception as e:
+        return f"RAG_ERROR::{e}", {"scores": [], "chunks": []}
+
+# Each tool carries a sync and a native async implementation, so both
+# `.invoke` and `.ainvoke` work without blocking the event loop.
+web_search_tool = StructuredTool.from_function(
+    func=web_search,
+    coroutine=aweb_search,
+    name="web_search_tool",
+    description="Up-to-date web info via Tavily",
+)
+
+# Invoked with a tool call, the ToolMessage carries the relevance scores
+# as its artifact; invoked with plain args it returns the chunks only.
+rag_search_tool = StructuredTool.from_function(
+    func=rag_search,
+    coroutine=arag_search,
+    name="rag_search_tool",
+    description="Top-3 chunks from KB (empty string if none)",
+    response_format="content_and_artifact",
+)
\ No newline at end of file
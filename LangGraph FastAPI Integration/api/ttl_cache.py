@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Size-bounded LRU cache with a time-to-live per entry.
+
+    Values must be JSON-serialisable when `persist_path` is set: entries are
+    then written through to a small SQLite file and reloaded on start-up, so
+    the cache survives restarts. Only `set` and `clear` touch the file, so
+    `get` never blocks on disk I/O; expired rows are purged on `set` and
+    ignored on load.
+    """
+
+    def __init__(self, max_entries: int, default_ttl: float,
+                 persist_path: Optional[str] = None, table: str = "cache"):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.persist_path = persist_path
+        self.table = table
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[Any, float]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0}
+        if persist_path:
+            self._load()
+
+    # ── Persistence ─────────────────────────────────────────────────
+    def _connect(self):
+        return sqlite3.connect(self.persist_path)
+
+    def _load(self):
+        conn = self._connect()
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.table}
+                         (key TEXT PRIMARY KEY,
+                          value TEXT,
+                          expires_at REAL,
+                          stored_at REAL)''')
+        now = time.time()
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+        conn.commit()
+        rows = conn.execute(f'SELECT key, value, expires_at FROM {self.table} ORDER BY stored_at DESC LIMIT ?',
+                            (self.max_entries,)).fetchall()
+        conn.close()
+        for key, value, expires_at in reversed(rows):
+            self._entries[key] = (json.loads(value), expires_at)
+
+    def _persist_set(self, key: str, value: Any, expires_at: float, evicted: list):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)',
+                     (key, json.dumps(value), expires_at, now))
+        if evicted:
+            conn.executemany(f'DELETE FROM {self.table} WHERE key = ?', [(k,) for k in evicted])
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+        conn.commit()
+        conn.close()
+
+    # ── Cache API ───────────────────────────────────────────────────
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._entries.get(key, _MISSING)
+            if item is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            value, expires_at = item
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return value
+            # The persisted row is left for the next set() to purge or overwrite
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+        return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.default_ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                evicted.append(old_key)
+            self._stats["sets"] += 1
+            self._stats["evictions"] += len(evicted)
+        if self.persist_path:
+            self._persist_set(key, value, expires_at, evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.persist_path:
+            conn = self._connect()
+            conn.execute(f'DELETE FROM {self.table}')
+            conn.commit()
+            conn.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self.persist_path),
+            }
@@ -1,5 +1,7 @@
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 import uuid
+import json
+import re
 from typing import List, Dict, Optional
 
 def get_or_create_session_id(session_id: Optional[str]) -> str:
@@ -18,4 +20,13 @@ def history_to_lc_messages(history: List[Dict]) -> List[BaseMessage]:
 
 def append_message(history: List[BaseMessage], message: BaseMessage) -> List[BaseMessage]:
     """Return a new list with the message appended."""
-    return history + [message] 
\ No newline at end of file
+    return history + [message]
+
+def normalize_question(text: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.rstrip("?.! ")
+
+def format_sse(event: str, data: Dict) -> str:
+    """Serialise one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
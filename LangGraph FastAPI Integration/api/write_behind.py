@@ -0,0 +1,120 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, List
+
+_STOP = object()
+# Attempts per flush before the rows are set aside and retried with a later one
+WRITE_ATTEMPTS = 3
+# Longest wait between flushes while writes keep failing
+MAX_RETRY_DELAY = 30.0
+
+class WriteBehindWriter:
+    """
+    Buffers rows on the request path and writes them from a background
+    thread, one transaction per batch.
+
+    Rows are flushed when `max_batch` rows are waiting or `flush_interval`
+    seconds after the first one arrived. Until a row is committed it stays
+    visible through `read_consistent`, so a session always reads its own
+    writes. Rows are tuples whose first element is the session id.
+
+    Rows of a batch that cannot be written are kept, not dropped: they stay
+    pending and are retried ahead of newer rows, with a growing delay,
+    until the database accepts them.
+    """
+
+    def __init__(self, write_batch: Callable[[List[tuple]], None],
+                 max_batch: int = 200, flush_interval: float = 0.05, name: str = "write-behind"):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = defaultdict(list)
+        # Held while a batch is committed and while a session with pending
+        # rows is read, so a row is never seen twice or missed
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, row: tuple):
+        with self._lock:
+            self._pending[row[0]].append(row)
+        self._queue.put(row)
+
+    def read_consistent(self, session_id, read_committed: Callable[[], list]):
+        """Return (committed rows from `read_committed()`, pending rows of the session)."""
+        with self._lock:
+            pending = list(self._pending.get(session_id, ()))
+            if pending:
+                return read_committed(), pending
+        return read_committed(), []
+
+    def _collect(self, batch: List[tuple]) -> List[tuple]:
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch: List[tuple]) -> bool:
+        """Commit `batch`; False if every attempt failed. Back-off waits do not hold the lock."""
+        for attempt in range(WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(0.1 * attempt)
+            with self._lock:
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    error = e
+                else:
+                    for row in batch:
+                        rows = self._pending.get(row[0])
+                        if rows:
+                            rows.pop(0)
+                            if not rows:
+                                del self._pending[row[0]]
+                    return True
+            logging.error(f"Write-behind flush of {len(batch)} rows failed (attempt {attempt + 1}): {error}")
+        return False
+
+    def _run(self):
+        unwritten, failures = [], 0
+        while True:
+            if unwritten:
+                time.sleep(min(0.5 * 2 ** failures, MAX_RETRY_DELAY))
+                # Older rows go first, so every session's rows keep their order
+                batch = self._collect(unwritten)
+            else:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch = self._collect([first])
+            if self._write(batch):
+                unwritten, failures = [], 0
+            else:
+                unwritten, failures = batch, failures + 1
+                logging.error(f"Write-behind keeps {len(batch)} unwritten rows for the next flush")
+
+    def close(self, timeout: float = 10.0):
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        if self._thread.is_alive():
+            with self._lock:
+                unwritten = sum(len(rows) for rows in self._pending.values())
+            logging.error(f"Write-behind writer did not finish within {timeout}s; {unwritten} rows are unwritten")
@@ -1,16 +1,62 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 from typing import List
 from langchain_core.documents import Document
+from embedding_cache import CachedEmbeddings
+from collections import defaultdict
+import hashlib
 import os
+import threading
+from startup import Lazy
+
+# ── Vector store backend ─────────────────────────────────────────────
+# "embedded" opens the index in-process under CHROMA_PERSIST_DIR, so only
+# one API process may use it; "http" talks to a Chroma server
+# (`chroma run --path ./chroma_db --port 8001`) that every API worker and
+# host shares
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded").lower()
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() == "true"
+CHROMA_AUTH_TOKEN = os.getenv("CHROMA_AUTH_TOKEN")
+# Keep-alive pool of the HTTP client, shared by every thread of the process
+CHROMA_HTTP_MAX_CONNECTIONS = int(os.getenv("CHROMA_HTTP_MAX_CONNECTIONS", "20"))
+CHROMA_HTTP_KEEPALIVE = float(os.getenv("CHROMA_HTTP_KEEPALIVE", "40"))
 
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-embedding_function = OpenAIEmbeddings()
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+
+def build_embeddings():
+    # langchain_openai and chromadb are slow to import; keep them off the import path
+    from langchain_openai import OpenAIEmbeddings
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+def chroma_http_client():
+    """Client of the Chroma server; its connection pool is reused by every call of this process."""
+    import chromadb
+    from chromadb.config import Settings
+    settings = Settings(anonymized_telemetry=False,
+                        chroma_http_max_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                        chroma_http_max_keepalive_connections=CHROMA_HTTP_MAX_CONNECTIONS,
+                        chroma_http_keepalive_secs=CHROMA_HTTP_KEEPALIVE)
+    headers = {"Authorization": f"Bearer {CHROMA_AUTH_TOKEN}"} if CHROMA_AUTH_TOKEN else None
+    return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL, headers=headers, settings=settings)
+
+def build_vectorstore():
+    from langchain_chroma import Chroma
+    if CHROMA_MODE == "http":
+        return Chroma(client=chroma_http_client(), collection_name=CHROMA_COLLECTION,
+                      embedding_function=embedding_function.instance())
+    return Chroma(persist_directory=CHROMA_PERSIST_DIR, collection_name=CHROMA_COLLECTION,
+                  embedding_function=embedding_function.instance())
+
+# Built on first use (or by the start-up warm-up, see startup.py).
+# Chunk embeddings go through a persistent content-addressed cache.
+embedding_function = Lazy("embeddings", build_embeddings)
+vectorstore = Lazy("chroma", build_vectorstore)
 
 def load_and_split_document(file_path: str) -> List[Document]:
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
     if file_path.endswith('.pdf'):
         loader = PyPDFLoader(file_path)
     elif file_path.endswith('.docx'):
@@ -23,6 +69,10 @@ def load_and_split_document(file_path: str) -> List[Document]:
     documents = loader.load()
     return text_splitter.split_documents(documents)
 
+def chunk_hash(text: str) -> str:
+    """Content hash stored as `chunk_hash` metadata; /update-doc matches chunks on it."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 def index_document_to_chroma(file_path: str, file_id: int) -> bool:
     try:
         splits = load_and_split_document(file_path)
@@ -30,6 +80,7 @@ def index_document_to_chroma(file_path: str, file_id: int) -> bool:
         # Add metadata to each split
         for split in splits:
             split.metadata['file_id'] = file_id
+            split.metadata['chunk_hash'] = chunk_hash(split.page_content)
         
         vectorstore.add_documents(splits)
         # vectorstore.persist()
@@ -40,7 +91,8 @@ def index_document_to_chroma(file_path: str, file_id: int) -> bool:
 
 def delete_doc_from_chroma(file_id: int):
     try:
-        docs = vectorstore.get(where={"file_id": file_id})
+        # Ids only; the chunk texts and metadata are not needed to count them
+        docs = vectorstore.get(where={"file_id": file_id}, include=[])
         print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
         
         vectorstore._collection.delete(where={"file_id": file_id})
@@ -50,3 +102,48 @@ def delete_doc_from_chroma(file_id: int):
     except Exception as e:
         print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
         return False
+
+def delete_docs_from_chroma(file_ids: List[int]) -> bool:
+    """Delete the chunks of every file in `file_ids` with one `where` filter, without reading them."""
+    try:
+        vectorstore._collection.delete(where={"file_id": {"$in": list(file_ids)}})
+        print(f"Deleted all documents with file_ids {list(file_ids)}")
+        return True
+    except Exception as e:
+        print(f"Error deleting documents with file_ids {list(file_ids)} from Chroma: {str(e)}")
+        return False
+
+# One update at a time per document, so two new versions cannot interleave
+_update_locks = defaultdict(threading.Lock)
+
+def update_doc_in_chroma(file_path: str, file_id: int) -> dict:
+    """
+    Sync the chunks of `file_id` with a new version of the document: chunks
+    whose hash is already stored are kept, only new ones are embedded and
+    added, then vanished ones are deleted. Chunks indexed before
+    `chunk_hash` existed are hashed from their stored text.
+    Returns the `kept`, `added` and `removed` chunk counts.
+    """
+    with _update_locks[file_id]:
+        stored = vectorstore.get(where={"file_id": file_id}, include=["documents", "metadatas"])
+        # chunk hash -> ids of the stored chunks with that text
+        unmatched = defaultdict(list)
+        for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+            unmatched[(metadata or {}).get('chunk_hash') or chunk_hash(text)].append(chunk_id)
+
+        new_splits = []
+        for split in load_and_split_document(file_path):
+            ids = unmatched.get(chunk_hash(split.page_content))
+            if ids:
+                ids.pop()
+            else:
+                split.metadata['file_id'] = file_id
+                split.metadata['chunk_hash'] = chunk_hash(split.page_content)
+                new_splits.append(split)
+        if new_splits:
+            vectorstore.add_documents(new_splits)
+
+        vanished = [chunk_id for ids in unmatched.values() for chunk_id in ids]
+        if vanished:
+            vectorstore.delete(ids=vanished)
+        return {"kept": len(stored['ids']) - len(vanished), "added": len(new_splits), "removed": len(vanished)}
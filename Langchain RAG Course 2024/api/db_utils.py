@@ -1,12 +1,93 @@
 import sqlite3
-from datetime import datetime
+import base64
+import json
+import os
+import queue
+import re
+from datetime import datetime, timezone
+from write_behind import WriteBehindWriter
 
 DB_NAME = "rag_app.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# Batch application log inserts in a background writer instead of one commit per request
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "true").lower() == "true"
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "200"))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "0.05"))
+
+# Applied to every new connection. WAL lets readers run concurrently with
+# the single writer, and synchronous=NORMAL is safe under WAL while
+# avoiding an fsync per commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+)
+
+class PooledConnection:
+    """sqlite3 connection proxy whose close() hands the connection back to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Thread-safe pool of up to `size` idle connections to one database file."""
+
+    def __init__(self, db_name, size):
+        self.db_name = db_name
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+pool = ConnectionPool(DB_NAME, DB_POOL_SIZE)
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection; call close() to return it."""
+    return pool.acquire()
 
 def create_application_logs():
     conn = get_db_connection()
@@ -19,24 +100,43 @@ def create_application_logs():
                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
     conn.close()
 
-def insert_application_logs(session_id, user_query, gpt_response, model):
+def write_application_logs_rows(rows):
+    """Insert (session_id, user_query, gpt_response, model, created_at) rows in one transaction."""
     conn = get_db_connection()
-    conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
-                 (session_id, user_query, gpt_response, model))
-    conn.commit()
-    conn.close()
+    try:
+        conn.executemany('INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def insert_application_logs(session_id, user_query, gpt_response, model):
+    # created_at is taken now, not when a batched row is finally written
+    row = (session_id, user_query, gpt_response, model, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    if application_logs_writer:
+        application_logs_writer.enqueue(row)
+    else:
+        write_application_logs_rows([row])
 
 def get_chat_history(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
+    def read_committed():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at, id', (session_id,))
+        rows = [(row['user_query'], row['gpt_response']) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    if application_logs_writer:
+        rows, pending = application_logs_writer.read_consistent(session_id, read_committed)
+    else:
+        rows, pending = read_committed(), []
     messages = []
-    for row in cursor.fetchall():
+    for user_query, gpt_response in rows + [(row[1], row[2]) for row in pending]:
         messages.extend([
-            {"role": "human", "content": row['user_query']},
-            {"role": "ai", "content": row['gpt_response']}
+            {"role": "human", "content": user_query},
+            {"role": "ai", "content": gpt_response}
         ])
-    conn.close()
     return messages
 
 def create_document_store():
@@ -56,6 +156,19 @@ def insert_document_record(filename):
     conn.close()
     return file_id
 
+def get_document(file_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, filename, upload_timestamp FROM document_store WHERE id = ?', (file_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def update_document_record(file_id, filename):
+    conn = get_db_connection()
+    conn.execute('UPDATE document_store SET filename = ?, upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?',
+                 (filename, file_id))
+    conn.commit()
+    conn.close()
+
 def delete_document_record(file_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
@@ -71,6 +184,97 @@ def get_all_documents():
     conn.close()
     return [dict(doc) for doc in documents]
 
+# ── Document listing and bulk delete ─────────────────────────────────
+# Pages are ordered newest first on (upload_timestamp, id). The cursor is
+# the last row of the previous page, so each page is one range scan of
+# idx_document_store_listing however deep it is
+def encode_document_cursor(document: dict) -> str:
+    raw = json.dumps([str(document['upload_timestamp']), document['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_document_cursor(cursor: str) -> tuple:
+    """Inverse of `encode_document_cursor`; raises ValueError for a malformed cursor."""
+    try:
+        timestamp, file_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(timestamp), int(file_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def sqlite_timestamp(value: datetime) -> str:
+    """`value` in the format and time zone (UTC) of CURRENT_TIMESTAMP columns."""
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def get_documents_page(limit, cursor=None, filename=None, uploaded_after=None, uploaded_before=None):
+    """
+    One page of documents, newest first, and the cursor of the next
+    page (None on the last one). `filename` matches case-insensitively
+    anywhere in the name; raises ValueError for a malformed cursor.
+    """
+    clauses, params = [], []
+    if cursor:
+        clauses.append('(upload_timestamp, id) < (?, ?)')
+        params.extend(decode_document_cursor(cursor))
+    if filename:
+        clauses.append("filename LIKE ? ESCAPE '\\'")
+        params.append('%' + re.sub(r'([\\%_])', r'\\\1', filename) + '%')
+    if uploaded_after:
+        clauses.append('upload_timestamp >= ?')
+        params.append(sqlite_timestamp(uploaded_after))
+    if uploaded_before:
+        clauses.append('upload_timestamp < ?')
+        params.append(sqlite_timestamp(uploaded_before))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT id, filename, upload_timestamp FROM document_store {where} "
+                        "ORDER BY upload_timestamp DESC, id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+    conn.close()
+    documents = [dict(row) for row in rows[:limit]]
+    return documents, (encode_document_cursor(documents[-1]) if len(rows) > limit else None)
+
+def get_existing_document_ids(file_ids):
+    """The ids among `file_ids` that have a document row."""
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT id FROM document_store WHERE id IN ({','.join('?' * len(file_ids))})",
+                        list(file_ids)).fetchall()
+    conn.close()
+    return {row['id'] for row in rows}
+
+def delete_document_records(file_ids):
+    """Delete many document rows in one transaction; returns the number deleted."""
+    conn = get_db_connection()
+    try:
+        deleted = conn.execute(f"DELETE FROM document_store WHERE id IN ({','.join('?' * len(file_ids))})",
+                               list(file_ids)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+# ── Migrations ───────────────────────────────────────────────────────
+# Applied in order at startup; PRAGMA user_version records how many ran.
+MIGRATIONS = [
+    # 1: get_chat_history filters by session and sorts by time
+    "CREATE INDEX IF NOT EXISTS idx_application_logs_session_created ON application_logs (session_id, created_at)",
+    # 2: get_documents_page pages through documents newest first
+    "CREATE INDEX IF NOT EXISTS idx_document_store_listing ON document_store (upload_timestamp, id)",
+]
+
+def run_migrations():
+    conn = get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {number}')
+    conn.commit()
+    conn.close()
+
 # Initialize the database tables
 create_application_logs()
 create_document_store()
+run_migrations()
+
+application_logs_writer = (WriteBehindWriter(write_application_logs_rows, DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL,
+                                             name="application-logs-writer")
+                           if DB_WRITE_BEHIND else None)
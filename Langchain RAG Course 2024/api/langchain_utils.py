@@ -1,13 +1,16 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from typing import List
 from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+import logging
 import os
 from chroma_utils import vectorstore
-retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
+from context_packer import pack_documents
+from startup import Lazy
+retriever = Lazy("retriever", lambda: vectorstore.instance().as_retriever(search_kwargs={"k": 2}))
 
 output_parser = StrOutputParser()
 
@@ -40,9 +43,18 @@ qa_prompt = ChatPromptTemplate.from_messages([
 
 
 
+def pack_retrieved(inputs: dict) -> List[Document]:
+    docs, packed = pack_documents(inputs["docs"])
+    logging.info(f"Context packer: {packed.summary()}")
+    return docs
+
 def get_rag_chain(model="gpt-4o-mini"):
+    from langchain_openai import ChatOpenAI
     llm = ChatOpenAI(model=model)
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+    history_aware_retriever = create_history_aware_retriever(llm, retriever.instance(), contextualize_q_prompt)
+    # Overlap between the retrieved chunks is trimmed and the context fitted
+    # into CONTEXT_TOKEN_BUDGET before it is stuffed into the prompt
+    packed_retriever = RunnablePassthrough.assign(docs=history_aware_retriever) | RunnableLambda(pack_retrieved)
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)    
+    rag_chain = create_retrieval_chain(packed_retriever, question_answer_chain)    
     return rag_chain
@@ -1,13 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
+# First import: times the service modules imported below (see /startup-report)
+import startup
+import asyncio
+from datetime import datetime
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, DeleteFilesRequest
 from langchain_utils import get_rag_chain
-from db_utils import insert_application_logs, get_chat_history, get_all_documents, insert_document_record, delete_document_record
-from chroma_utils import index_document_to_chroma, delete_doc_from_chroma
+from db_utils import (insert_application_logs, get_chat_history, insert_document_record,
+                      delete_document_record, application_logs_writer, get_document, update_document_record,
+                      get_documents_page, get_existing_document_ids, delete_document_records)
+from chroma_utils import index_document_to_chroma, delete_doc_from_chroma, delete_docs_from_chroma, update_doc_in_chroma
 import os
 import uuid
 import logging
+from contextlib import asynccontextmanager
 logging.basicConfig(filename='app.log', level=logging.INFO)
-app = FastAPI()
+
+# Documents per /list-docs page unless the request sets `limit`
+LIST_DOCS_PAGE_SIZE = int(os.getenv("LIST_DOCS_PAGE_SIZE", "100"))
+LIST_DOCS_MAX_PAGE_SIZE = 1000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the embeddings client, the Chroma store and the retriever in the
+    # background so the server accepts connections right away (see /ready)
+    warmup = (asyncio.get_running_loop().run_in_executor(None, startup.warm_up)
+              if startup.STARTUP_WARMUP else None)
+    yield
+    if warmup and not warmup.done():
+        await warmup
+    # Flush log rows still waiting in the write-behind queue
+    if application_logs_writer:
+        application_logs_writer.close()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.post("/chat", response_model=QueryResponse)
 def chat(query_input: QueryInput):
@@ -60,9 +87,51 @@ def upload_and_index_document(file: UploadFile = File(...)):
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
+@app.post("/update-doc/{file_id}")
+def update_document(file_id: int, file: UploadFile = File(...)):
+    """Replace a document with a new version, embedding only the chunks that changed."""
+    allowed_extensions = ['.pdf', '.docx', '.html']
+    file_extension = os.path.splitext(file.filename)[1].lower()
+
+    if file_extension not in allowed_extensions:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
+    if get_document(file_id) is None:
+        raise HTTPException(status_code=404, detail=f"Document with file_id {file_id} not found.")
+
+    temp_file_path = f"temp_{uuid.uuid4().hex}_{file.filename}"
+
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+
+        try:
+            counts = update_doc_in_chroma(temp_file_path, file_id)
+        except Exception as e:
+            logging.error(f"Failed to update file_id {file_id}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to update {file.filename}.")
+        update_document_record(file_id, file.filename)
+        return {"message": f"File {file.filename} has been re-indexed.", "file_id": file_id, **counts}
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
 @app.get("/list-docs", response_model=list[DocumentInfo])
-def list_documents():
-    return get_all_documents()
+def list_documents(response: Response,
+                   limit: int = Query(LIST_DOCS_PAGE_SIZE, ge=1, le=LIST_DOCS_MAX_PAGE_SIZE),
+                   cursor: Optional[str] = None, filename: Optional[str] = None,
+                   uploaded_after: Optional[datetime] = None, uploaded_before: Optional[datetime] = None):
+    """
+    Documents, newest first, `limit` per page, optionally filtered by a
+    filename substring and upload time. When there are more, the
+    `X-Next-Cursor` header holds the `cursor` of the next page.
+    """
+    try:
+        documents, next_cursor = get_documents_page(limit, cursor, filename, uploaded_after, uploaded_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
 
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
@@ -78,3 +147,29 @@ def delete_document(request: DeleteFileRequest):
             return {"error": f"Deleted from Chroma but failed to delete document with file_id {request.file_id} from the database."}
     else:
         return {"error": f"Failed to delete document with file_id {request.file_id} from Chroma."}
+
+@app.post("/delete-docs")
+def delete_documents(request: DeleteFilesRequest):
+    """Delete many documents: one Chroma delete filtered on `file_id`, then the rows in one SQLite transaction."""
+    file_ids = list(dict.fromkeys(request.file_ids))
+    existing = get_existing_document_ids(file_ids)
+    deleted = [file_id for file_id in file_ids if file_id in existing]
+    if deleted:
+        if not delete_docs_from_chroma(deleted):
+            raise HTTPException(status_code=500, detail="Failed to delete the documents from Chroma.")
+        delete_document_records(deleted)
+    return {"deleted": deleted, "not_found": [file_id for file_id in file_ids if file_id not in existing]}
+
+@app.get("/ready")
+def ready():
+    """200 once the start-up warm-up has finished; 503 with the steps still pending before that."""
+    if startup.STARTUP_WARMUP:
+        pending = startup.pending()
+        if pending:
+            return JSONResponse(status_code=503, content={"ready": False, "pending": pending})
+    return {"ready": True}
+
+@app.get("/startup-report")
+def startup_report():
+    """Import time per service module, build time of each lazy singleton and the warm-up timeline."""
+    return startup.report()
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
+from typing import List
 
 class ModelName(str, Enum):
     GPT4_O = "gpt-4o"
@@ -22,4 +23,7 @@ class DocumentInfo(BaseModel):
     upload_timestamp: datetime
 
 class DeleteFileRequest(BaseModel):
-    file_id: int
\ No newline at end of file
+    file_id: int
+
+class DeleteFilesRequest(BaseModel):
+    file_ids: List[int] = Field(min_length=1, max_length=500)
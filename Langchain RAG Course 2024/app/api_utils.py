@@ -39,13 +39,19 @@ def upload_document(file):
         return None
 
 def list_documents():
+    # /list-docs is paginated; follow X-Next-Cursor until the last page
+    documents, params = [], {}
     try:
-        response = requests.get("http://localhost:8000/list-docs")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Failed to fetch document list. Error: {response.status_code} - {response.text}")
-            return []
+        while True:
+            response = requests.get("http://localhost:8000/list-docs", params=params)
+            if response.status_code != 200:
+                st.error(f"Failed to fetch document list. Error: {response.status_code} - {response.text}")
+                return []
+            documents.extend(response.json())
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                return documents
+            params = {"cursor": next_cursor}
     except Exception as e:
         st.error(f"An error occurred while fetching the document list: {str(e)}")
         return []
@@ -0,0 +1,183 @@
+"""
+Check the services' CHROMA_MODE=http backend against a local Chroma server.
+
+Starts `chroma run` on a free port with a temporary data directory, then runs
+--workers processes per service at the same time, the way several uvicorn
+workers would: each imports the service's chroma_utils with CHROMA_MODE=http
+(OpenAI embeddings replaced by fakes.py) and indexes, re-indexes
+(update_doc_in_chroma) and deletes its own documents while querying the
+shared collection. Afterwards it checks that:
+
+  * every worker finished without an error,
+  * the server holds exactly the chunks each worker reported for its documents,
+  * re-indexing over HTTP kept the unchanged chunks,
+  * deleted documents are gone.
+
+Needs `chromadb` (for the `chroma` command), `langchain-chroma`, `pypdf` and
+the services' requirements. Exits non-zero on a failed check.
+
+    python benchmarks/chroma_server_check.py --workers 4 --docs 3
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+SERVICES = {
+    "langgraph": "LangGraph FastAPI Integration/api",
+    "rag-course": "Langchain RAG Course 2024/api",
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_chroma(path: str, port: int) -> subprocess.Popen:
+    command = shutil.which("chroma")
+    if not command:
+        sys.exit("the `chroma` command was not found; pip install chromadb")
+    process = subprocess.Popen([command, "run", "--path", path, "--host", "127.0.0.1", "--port", str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                sys.exit("chroma server exited on start-up")
+            time.sleep(0.2)
+    process.kill()
+    sys.exit("chroma server did not start within 30s")
+
+def worker_file_ids(worker: int, docs: int) -> list:
+    return [worker * 100 + i + 1 for i in range(docs)]
+
+# ── Worker process ───────────────────────────────────────────────────
+def worker(args):
+    """One API-like process: index, re-index and delete its documents through chroma_utils."""
+    from fakes import install_fakes
+    from load_test import make_pdf
+    install_fakes()
+    os.chdir(args.workdir)
+    sys.path.insert(0, os.path.join(REPO, SERVICES[args.service]))
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+    import chroma_utils
+
+    result = {"documents": {}, "errors": [], "queries": 0}
+    docs_dir = tempfile.mkdtemp(prefix="chroma-check-docs-")
+    file_ids = worker_file_ids(args.worker, args.docs)
+    for file_id in file_ids:
+        try:
+            path = os.path.join(docs_dir, f"doc-{file_id}.pdf")
+            make_pdf(path, args.pages, seed=file_id)
+            if not chroma_utils.index_document_to_chroma(path, file_id):
+                raise RuntimeError(f"indexing file_id {file_id} failed")
+            # Same seed, one more page: the first pages' chunks are unchanged
+            make_pdf(path, args.pages + 1, seed=file_id)
+            counts = chroma_utils.update_doc_in_chroma(path, file_id)
+            chroma_utils.vectorstore.similarity_search("retention policy", k=2)
+            result["queries"] += 1
+            chunks = len(chroma_utils.vectorstore.get(where={"file_id": file_id}, include=[])["ids"])
+            result["documents"][file_id] = {**counts, "chunks": chunks, "deleted": False}
+        except Exception as e:
+            result["errors"].append(f"file_id {file_id}: {e!r}")
+    # Delete the first document again
+    if file_ids[0] in result["documents"]:
+        chroma_utils.delete_doc_from_chroma(file_ids[0])
+        result["documents"][file_ids[0]].update(chunks=0, deleted=True)
+    with open(args.child_out, "w") as f:
+        json.dump(result, f)
+
+# ── Checks ───────────────────────────────────────────────────────────
+def check_service(service: str, args, port: int) -> dict:
+    import chromadb
+    from chromadb.config import Settings
+
+    workdir = tempfile.mkdtemp(prefix=f"chroma-check-{service}-")
+    collection = f"check-{service}"
+    env = {**os.environ, "CHROMA_MODE": "http", "CHROMA_HOST": "127.0.0.1", "CHROMA_PORT": str(port),
+           "CHROMA_COLLECTION": collection}
+    children = []
+    t0 = time.perf_counter()
+    for number in range(args.workers):
+        fd, out = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        cmd = [sys.executable, os.path.abspath(__file__), "--service", service, "--worker", str(number),
+               "--workdir", workdir, "--docs", str(args.docs), "--pages", str(args.pages), "--child-out", out]
+        children.append((subprocess.Popen(cmd, env=env), out))
+    results, failed = [], []
+    for process, out in children:
+        # The worker writes its result only once it has finished
+        if process.wait() != 0 or not os.path.getsize(out):
+            failed.append(f"worker exited with {process.returncode}")
+            os.remove(out)
+            continue
+        with open(out) as f:
+            results.append(json.load(f))
+        os.remove(out)
+    wall = time.perf_counter() - t0
+
+    client = chromadb.HttpClient(host="127.0.0.1", port=port, settings=Settings(anonymized_telemetry=False))
+    stored = client.get_collection(collection).get(include=["metadatas"])
+    on_server = {}
+    for metadata in stored["metadatas"]:
+        on_server[metadata["file_id"]] = on_server.get(metadata["file_id"], 0) + 1
+
+    documents = {int(k): v for r in results for k, v in r["documents"].items()}
+    mismatched = {k: (v["chunks"], on_server.get(k, 0)) for k, v in documents.items()
+                  if v["chunks"] != on_server.get(k, 0)}
+    checks = {
+        "workers_succeeded": (not failed and not any(r["errors"] for r in results),
+                              failed + [e for r in results for e in r["errors"]][:3] or f"{len(results)} workers"),
+        "chunks_match_server": (not mismatched and documents,
+                                mismatched or f"{len(documents)} documents, {len(stored['ids'])} chunks on the server"),
+        "update_kept_chunks": (all(v["kept"] > 0 and v["added"] > 0 for v in documents.values()),
+                               {k: {"kept": v["kept"], "added": v["added"]} for k, v in list(documents.items())[:3]}),
+        "deleted_documents_gone": (all(on_server.get(k, 0) == 0 for k, v in documents.items() if v["deleted"]),
+                                   f"{sum(v['deleted'] for v in documents.values())} deleted"),
+    }
+    return {"wall_s": round(wall, 3), "queries": sum(r["queries"] for r in results),
+            "checks": {name: {"passed": bool(passed), "detail": detail} for name, (passed, detail) in checks.items()}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="langgraph,rag-course", help=f"comma-separated: {', '.join(SERVICES)}")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent worker processes per service")
+    parser.add_argument("--docs", type=int, default=3, help="documents per worker")
+    parser.add_argument("--pages", type=int, default=3, help="pages per document")
+    parser.add_argument("--service", choices=SERVICES, help=argparse.SUPPRESS)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_out:
+        return worker(args)
+
+    data_dir = tempfile.mkdtemp(prefix="chroma-server-")
+    port = free_port()
+    server = start_chroma(data_dir, port)
+    report, ok = {}, True
+    try:
+        for service in args.services.split(","):
+            print(f"running {service} ...", flush=True)
+            report[service] = check_service(service, args, port)
+            ok = ok and all(c["passed"] for c in report[service]["checks"].values())
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for the per-turn SQLite work of the chat APIs.
+
+Grows the history table to each checkpoint size and times one chat turn's
+database work (load the session history, then store the new turn). With the
+(session_id, created_at) index the per-turn latency should stay flat as the
+table grows; pass --no-index to see the full-table-scan baseline.
+
+    python benchmarks/db_latency.py --service langgraph --checkpoints 10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "langgraph": ("LangGraph FastAPI Integration/api", "chat_history", "insert_chat_history"),
+    "rag-course": ("Langchain RAG Course 2024/api", "application_logs", "insert_application_logs"),
+}
+TURNS_PER_SESSION = 10
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def fill(db_utils, table, start, end):
+    """Insert rows [start, end) spread over sessions of TURNS_PER_SESSION turns."""
+    conn = db_utils.get_db_connection()
+    batch = []
+    for i in range(start, end):
+        batch.append((f"session-{i // TURNS_PER_SESSION}", f"question {i}", f"answer {i}", "bench"))
+        if len(batch) == 50_000:
+            conn.executemany(f"INSERT INTO {table} (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)", batch)
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(f"INSERT INTO {table} (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)", batch)
+        conn.commit()
+    conn.close()
+
+def measure(db_utils, insert_fn, rows, turns):
+    sessions = max(rows // TURNS_PER_SESSION, 1)
+    samples = []
+    for _ in range(turns):
+        session_id = f"session-{random.randrange(sessions)}"
+        t0 = time.perf_counter()
+        db_utils.get_chat_history(session_id)
+        insert_fn(session_id, "follow-up", "reply", "bench")
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {
+        "rows": rows,
+        "turns": turns,
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=SERVICES, default="langgraph")
+    parser.add_argument("--checkpoints", default="10000,100000,1000000",
+                        help="comma-separated table sizes to measure at")
+    parser.add_argument("--turns", type=int, default=500, help="timed turns per checkpoint")
+    parser.add_argument("--no-index", action="store_true", help="drop the session index (baseline)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    api_dir, table, insert_name = SERVICES[args.service]
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix="db-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.join(ROOT, api_dir))
+    import db_utils  # creates the tables and runs the migrations in workdir
+
+    if args.no_index:
+        conn = db_utils.get_db_connection()
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)):
+            conn.execute(f"DROP INDEX {name}")
+        conn.commit()
+        conn.close()
+
+    insert_fn = getattr(db_utils, insert_name)
+    results = []
+    rows = 0
+    for checkpoint in sorted(int(c) for c in args.checkpoints.split(",")):
+        fill(db_utils, table, rows, checkpoint)
+        rows = checkpoint
+        result = measure(db_utils, insert_fn, rows, args.turns)
+        rows += args.turns
+        results.append(result)
+        print(f"{result['rows']:>10,} rows  p50 {result['p50_ms']:8.3f} ms  "
+              f"p95 {result['p95_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms", flush=True)
+
+    report = {"service": args.service, "indexed": not args.no_index, "results": results}
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Deterministic local stand-ins for OpenAI chat/embedding models and Tavily.
+
+`install_fakes()` swaps them into `langchain_openai` / `langchain_tavily`
+(and a local tokenizer into `tiktoken`, whose encodings are otherwise
+downloaded on first use) before a service is imported, so the services run
+unmodified without network access or API keys. Every reply, vector and injected delay is
+derived from a hash of the input, so a run is reproducible whatever order
+concurrent requests arrive in. `CALLS` counts upstream calls and tokens.
+"""
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.language_models.chat_models import BaseChatModel
+
+CALLS = Counter()
+
+GREETINGS = ("hi", "hello", "hey", "thanks", "thank you", "good morning")
+
+@dataclass
+class Latency:
+    """Injected upstream latency; `jitter` is the +/- fraction applied per call."""
+    llm_first_token_ms: float = 300.0
+    llm_ms_per_token: float = 5.0
+    embed_ms: float = 50.0
+    embed_ms_per_text: float = 0.5
+    search_ms: float = 400.0
+    jitter: float = 0.2
+    # Share of RAG judgements that ask for the web fallback
+    web_fallback_rate: float = 0.2
+
+LATENCY = Latency()
+
+def stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+
+def unit(text: str) -> float:
+    """Deterministic value in [0, 1) for `text`."""
+    return stable_hash(text) % 10_000 / 10_000
+
+def jittered(ms: float, key: str) -> float:
+    return max(ms * (1 + LATENCY.jitter * (2 * unit(key) - 1)), 0.0) / 1000
+
+def words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def approx_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+# ── Chat model ───────────────────────────────────────────────────────
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering from the prompt text alone. Recognises the
+    services' contextualise and summary prompts, and supports
+    `with_structured_output` for RouteDecision, RagJudge and TurnPlan.
+    """
+    model_name: str = "fake-chat"
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    # ── Replies ─────────────────────────────────────────────────────
+    @staticmethod
+    def _prompt(messages: List[BaseMessage]) -> tuple[str, str]:
+        system = " ".join(m.content for m in messages if isinstance(m, SystemMessage))
+        last = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        return system, last
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        system, last = self._prompt(messages)
+        if "standalone question" in system:
+            return last
+        if "running summary" in system:
+            return "Summary: " + " ".join(words(last)[:40])
+        topic = " ".join(words(last)[:6]) or "the question"
+        filler = [f"point{(stable_hash(last) + i) % 97}" for i in range(self.answer_words)]
+        return f"Regarding {topic}: " + " ".join(filler)
+
+    def _usage(self, messages: List[BaseMessage], reply: str) -> dict:
+        input_tokens = sum(approx_tokens(str(m.content)) for m in messages)
+        output_tokens = approx_tokens(reply)
+        CALLS["llm_calls"] += 1
+        CALLS["llm_input_tokens"] += input_tokens
+        CALLS["llm_output_tokens"] += output_tokens
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _delay(self, key: str, tokens: int) -> float:
+        return jittered(LATENCY.llm_first_token_ms + LATENCY.llm_ms_per_token * tokens, key)
+
+    # ── BaseChatModel ───────────────────────────────────────────────
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        time.sleep(self._delay(reply, approx_tokens(reply)))
+        message = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        await asyncio.sleep(self._delay(reply, approx_tokens(reply)))
+        message = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        reply = self._reply(messages)
+        time.sleep(jittered(LATENCY.llm_first_token_ms, reply))
+        for i, token in enumerate(re.findall(r"\S+\s*", reply)):
+            if i:
+                time.sleep(LATENCY.llm_ms_per_token / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, reply)))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        reply = self._reply(messages)
+        await asyncio.sleep(jittered(LATENCY.llm_first_token_ms, reply))
+        for i, token in enumerate(re.findall(r"\S+\s*", reply)):
+            if i:
+                await asyncio.sleep(LATENCY.llm_ms_per_token / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, reply)))
+
+    # ── Structured output ───────────────────────────────────────────
+    def _structured(self, schema, messages: List[BaseMessage]):
+        system, last = self._prompt(messages)
+        name = schema.__name__
+        if name in ("RouteDecision", "TurnPlan"):
+            text = last.lower().strip()
+            extra = {"standalone_question": last} if name == "TurnPlan" else {}
+            if text.startswith(GREETINGS):
+                return schema(route="end", reply="Hello! How can I help?", **extra)
+            return schema(route="rag" if "section" in text or "document" in text else "answer", **extra)
+        if name == "RagJudge":
+            question = last.split("\n\n", 1)[0]
+            insufficient = "RAG_ERROR::" in last or len(last) < 300 or unit(question) < LATENCY.web_fallback_rate
+            return schema(sufficient=not insufficient)
+        raise ValueError(f"FakeChatModel has no structured response for {name}")
+
+    def with_structured_output(self, schema, **kwargs):
+        def decide(input):
+            messages = self._convert_input(input).to_messages()
+            result = self._structured(schema, messages)
+            self._usage(messages, result.model_dump_json())
+            time.sleep(self._delay(str(result), 20))
+            return result
+
+        async def adecide(input):
+            messages = self._convert_input(input).to_messages()
+            result = self._structured(schema, messages)
+            self._usage(messages, result.model_dump_json())
+            await asyncio.sleep(self._delay(str(result), 20))
+            return result
+
+        return RunnableLambda(decide, afunc=adecide, name=f"fake_structured_{schema.__name__}")
+
+def fake_chat_openai(*args, model: str = None, model_name: str = None, **kwargs) -> FakeChatModel:
+    return FakeChatModel(model_name=model or model_name or "fake-chat")
+
+# ── Embeddings ───────────────────────────────────────────────────────
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: texts sharing words have a high cosine similarity."""
+
+    def __init__(self, *args, dimensions: int = 256, **kwargs):
+        self.model = "fake-embedding"
+        self.dimensions = dimensions
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in words(text):
+            h = stable_hash(word)
+            vector[h % self.dimensions] += 1.0 if h & 1 << 40 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _delay(self, texts: List[str]) -> float:
+        CALLS["embedding_calls"] += 1
+        CALLS["embedding_texts"] += len(texts)
+        return jittered(LATENCY.embed_ms + LATENCY.embed_ms_per_text * len(texts), texts[0] if texts else "")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self._delay([text]))
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(texts))
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self._delay([text]))
+        return self._vector(text)
+
+# ── Tokenizer ────────────────────────────────────────────────────────
+class FakeEncoding:
+    """
+    Stand-in for a tiktoken `Encoding`: splits text into word pieces of up to
+    four characters (with their leading whitespace) and single punctuation
+    marks, roughly the size of real BPE tokens. `decode` reverses `encode`
+    exactly, so truncating to a token budget works as with tiktoken.
+    """
+    _PIECE = re.compile(r"\s*\w{1,4}|\s*[^\w\s]|\s+")
+
+    def __init__(self, name: str = "fake"):
+        self.name = name
+        self._ids: Dict[str, int] = {}
+        self._pieces: List[str] = []
+        self._lock = threading.Lock()
+
+    def _id(self, piece: str) -> int:
+        token = self._ids.get(piece)
+        if token is None:
+            with self._lock:
+                token = self._ids.setdefault(piece, len(self._pieces))
+                if token == len(self._pieces):
+                    self._pieces.append(piece)
+        return token
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return [self._id(piece) for piece in self._PIECE.findall(text)]
+
+    def encode_ordinary(self, text: str) -> List[int]:
+        return self.encode(text)
+
+    def decode(self, tokens: List[int], **kwargs) -> str:
+        return "".join(self._pieces[t] for t in tokens)
+
+_encodings: Dict[str, FakeEncoding] = {}
+
+def fake_get_encoding(name: str) -> FakeEncoding:
+    return _encodings.setdefault(name, FakeEncoding(name))
+
+# ── Web search ───────────────────────────────────────────────────────
+class FakeTavilySearch:
+    """Returns three canned results in the Tavily response shape."""
+
+    def __init__(self, *args, max_results: int = 3, **kwargs):
+        self.max_results = max_results
+
+    def _results(self, input) -> dict:
+        query = input["query"] if isinstance(input, dict) else str(input)
+        CALLS["search_calls"] += 1
+        return {"query": query, "results": [
+            {"title": f"Result {i + 1} for {query}", "url": f"https://example.com/{stable_hash(query) % 10_000}/{i}",
+             "content": f"Web snippet {i + 1} about {query}. " * 5}
+            for i in range(self.max_results)
+        ]}
+
+    def invoke(self, input, config=None, **kwargs) -> dict:
+        time.sleep(jittered(LATENCY.search_ms, str(input)))
+        return self._results(input)
+
+    async def ainvoke(self, input, config=None, **kwargs) -> dict:
+        await asyncio.sleep(jittered(LATENCY.search_ms, str(input)))
+        return self._results(input)
+
+def install_fakes(latency: Latency = None):
+    """Patch the fakes into the client libraries; call before importing a service."""
+    global LATENCY
+    if latency is not None:
+        LATENCY = latency
+    import tiktoken
+    tiktoken.get_encoding = fake_get_encoding
+    import langchain_openai
+    langchain_openai.ChatOpenAI = fake_chat_openai
+    langchain_openai.OpenAIEmbeddings = FakeEmbeddings
+    try:
+        import langchain_tavily
+        langchain_tavily.TavilySearch = FakeTavilySearch
+    except ImportError:
+        # Only the LangGraph service uses Tavily
+        pass
@@ -0,0 +1,132 @@
+"""
+Check the LangGraph service's shared OpenAI HTTP client against mock_openai.py.
+
+Fires a burst of concurrent chat and embedding calls through clients built
+with `http_clients.openai_client_kwargs()` while the mock server throttles
+every --rate-limit-every-th request, then checks that:
+
+  * every call succeeded (429s were retried by the transport),
+  * requests in flight per upstream never exceeded LLM_MAX_CONCURRENCY /
+    EMBEDDING_MAX_CONCURRENCY,
+  * TCP connections stayed within HTTP_MAX_CONNECTIONS,
+  * a throttled call waited at least the server's Retry-After.
+
+--baseline repeats the burst with one default client per model (the old
+setup) for a connection-count comparison. Exits non-zero on a failed check.
+
+    python benchmarks/http_clients_check.py --calls 200 --llm-limit 8 --embedding-limit 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+API_DIR = os.path.join(REPO, "LangGraph FastAPI Integration/api")
+
+async def burst(chat_models, embeddings, calls: int) -> list:
+    async def one(i):
+        if i % 4 == 3:
+            return await embeddings.aembed_documents([f"chunk {i}", f"chunk {i + 1}"])
+        return (await chat_models[i % len(chat_models)].ainvoke(f"question {i}")).content
+
+    return await asyncio.gather(*(one(i) for i in range(calls)), return_exceptions=True)
+
+def run_check(args) -> bool:
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+    from mock_openai import start_server
+
+    server, state = start_server(latency_ms=args.latency_ms, rate_limit_every=args.rate_limit_every,
+                                 retry_after=args.retry_after)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ.update({
+        "LLM_MAX_CONCURRENCY": str(args.llm_limit),
+        "EMBEDDING_MAX_CONCURRENCY": str(args.embedding_limit),
+        "HTTP_MAX_CONNECTIONS": str(args.max_connections),
+        "HTTP_MAX_RETRIES": "6",
+    })
+    sys.path.insert(0, API_DIR)
+    os.chdir(tempfile.mkdtemp(prefix="http-clients-"))
+    import http_clients
+
+    def models(**kwargs):
+        # Five chat models, as the service builds (router, judge, planner, answer, contextualise)
+        chat = [ChatOpenAI(model="gpt-4.1-mini", base_url=base_url, api_key="sk-mock", **kwargs) for _ in range(5)]
+        embed = OpenAIEmbeddings(base_url=base_url, api_key="sk-mock", check_embedding_ctx_length=False, **kwargs)
+        return chat, embed
+
+    results, ok = {}, True
+
+    def check(name: str, passed: bool, detail):
+        nonlocal ok
+        ok = ok and passed
+        results[name] = {"passed": passed, "detail": detail}
+
+    async def scenario():
+        # Burst through the shared client
+        chat, embed = models(**http_clients.openai_client_kwargs())
+        t0 = time.perf_counter()
+        outcomes = await burst(chat, embed, args.calls)
+        wall = time.perf_counter() - t0
+        stats = state.snapshot()
+        errors = [repr(o) for o in outcomes if isinstance(o, BaseException)]
+        check("all_calls_succeeded", not errors, errors[:3] or f"{args.calls} calls in {wall:.2f}s")
+        check("llm_concurrency_bounded", stats["peak_in_flight"]["chat"] <= args.llm_limit,
+              f"peak {stats['peak_in_flight']['chat']} / limit {args.llm_limit}")
+        check("embedding_concurrency_bounded", stats["peak_in_flight"]["embeddings"] <= args.embedding_limit,
+              f"peak {stats['peak_in_flight']['embeddings']} / limit {args.embedding_limit}")
+        check("connections_bounded", stats["connections"] <= args.max_connections,
+              f"{stats['connections']} connections / limit {args.max_connections}")
+        check("rate_limits_retried", stats["rate_limited"] > 0 and not errors,
+              f"{stats['rate_limited']} responses were 429")
+        report = {"shared_client": {**stats, "wall_s": round(wall, 3)}}
+
+        # Throttle everything until the first attempt has had its 429, so
+        # the call can only succeed on a retry after Retry-After
+        state.rate_limit_every = 1
+        t0 = time.perf_counter()
+        task = asyncio.ensure_future(chat[0].ainvoke("probe"))
+        await asyncio.sleep(args.retry_after / 4)
+        state.rate_limit_every = 0
+        await task
+        waited = time.perf_counter() - t0
+        check("retry_after_respected", waited >= args.retry_after,
+              f"call took {waited:.3f}s, Retry-After {args.retry_after}s")
+
+        if args.baseline:
+            baseline_server, baseline_state = start_server(latency_ms=args.latency_ms)
+            baseline_url = f"http://127.0.0.1:{baseline_server.server_address[1]}/v1"
+            chat = [ChatOpenAI(model="gpt-4.1-mini", base_url=baseline_url, api_key="sk-mock") for _ in range(5)]
+            embed = OpenAIEmbeddings(base_url=baseline_url, api_key="sk-mock", check_embedding_ctx_length=False)
+            t0 = time.perf_counter()
+            await burst(chat, embed, args.calls)
+            report["baseline"] = {**baseline_state.snapshot(), "wall_s": round(time.perf_counter() - t0, 3)}
+            baseline_server.shutdown()
+        await http_clients.close_http_clients()
+        return report
+
+    report = asyncio.run(scenario())
+    report["checks"] = results
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--rate-limit-every", type=int, default=7)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--llm-limit", type=int, default=8)
+    parser.add_argument("--embedding-limit", type=int, default=4)
+    parser.add_argument("--max-connections", type=int, default=20)
+    parser.add_argument("--baseline", action="store_true", help="also run the burst with per-model default clients")
+    args = parser.parse_args()
+    sys.exit(0 if run_check(args) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Offline load test for the chat/document endpoints of both services.
+
+OpenAI and Tavily are replaced by the deterministic fakes in fakes.py
+(with injected latency), and each service is served by uvicorn on a local
+port from its own subprocess and temporary working directory, so streamed
+responses reach the client chunk by chunk as they would in production. A scripted workload, seeded
+by --seed, uploads PDFs of several sizes, replays chat sessions of mixed
+lengths with bounded concurrency, lists and finally deletes the documents.
+Per-endpoint p50/p95/p99 and throughput go to a JSON report; --compare
+prints the change between two reports (e.g. from two commits).
+
+    python benchmarks/load_test.py --json bench-new.json
+    python benchmarks/load_test.py --compare bench-old.json bench-new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import fields
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+# name -> (api directory, extra environment)
+SERVICES = {
+    "langgraph": ("LangGraph FastAPI Integration/api", {}),
+    "langgraph-planner": ("LangGraph FastAPI Integration/api", {"PLANNER_MODE": "true"}),
+    "rag-course": ("Langchain RAG Course 2024/api", {}),
+}
+LANGGRAPH = ("langgraph", "langgraph-planner")
+TOPICS = ["pricing", "latency", "security", "onboarding", "storage", "billing", "retention", "support",
+          "compliance", "roadmap", "caching", "indexing"]
+SESSION_LENGTHS = [1, 1, 3, 3, 3, 8]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+# ── Workload ─────────────────────────────────────────────────────────
+def make_pdf(path: str, pages: int, seed: int):
+    """Write a plain-text PDF with `pages` pages of deterministic prose."""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = []
+        for line in range(60):
+            topic = rng.choice(TOPICS)
+            lines.append(f"Section {page + 1}.{line + 1}: the {topic} policy covers {rng.choice(TOPICS)} "
+                         f"and {rng.choice(TOPICS)} for team {rng.randrange(100)}.")
+        stream = "BT /F1 9 Tf 36 770 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def build_workload(args) -> dict:
+    """The same seed always gives the same documents, sessions and questions."""
+    rng = random.Random(args.seed)
+    documents = [{"name": f"report-{pages}p-{i}.pdf", "pages": pages, "seed": rng.randrange(1 << 30)}
+                 for pages in (int(p) for p in args.doc_pages.split(","))
+                 for i in range(args.docs_per_size)]
+    sessions = []
+    for s in range(args.sessions):
+        turns = []
+        for t in range(rng.choice(SESSION_LENGTHS)):
+            kind = rng.random()
+            topic = rng.choice(TOPICS)
+            if t == 0 and kind < 0.1:
+                question = "Hello there!"
+            elif kind < 0.7:
+                question = f"What does section {rng.randrange(1, 40)} of the document say about {topic}?"
+            elif t:
+                question = f"And how does that relate to {topic}?"
+            else:
+                question = f"Explain {topic} in one paragraph."
+            turns.append({"question": question, "stream": rng.random() < args.stream_ratio})
+        sessions.append({"session_id": f"bench-{args.seed}-{s}", "turns": turns})
+    return {"documents": documents, "sessions": sessions}
+
+# ── Runner (one service per process) ─────────────────────────────────
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint: str, seconds: float, ok: bool = True):
+        self.samples[endpoint].append(seconds * 1000)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self) -> dict:
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            report[endpoint] = {
+                "count": len(samples),
+                "errors": self.errors[endpoint],
+                "p50_ms": round(statistics.median(samples), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "mean_ms": round(statistics.fmean(samples), 2),
+                "max_ms": round(max(samples), 2),
+            }
+        return report
+
+async def timed(recorder: Recorder, endpoint: str, call):
+    t0 = time.perf_counter()
+    try:
+        response = await call
+    except Exception:
+        recorder.add(endpoint, time.perf_counter() - t0, ok=False)
+        raise
+    recorder.add(endpoint, time.perf_counter() - t0, ok=response.status_code < 400)
+    return response
+
+async def upload(client, recorder, service, path, name):
+    with open(path, "rb") as f:
+        response = await timed(recorder, "/upload-doc", client.post("/upload-doc", files={"file": (name, f.read())}))
+    body = response.json()
+    if service not in LANGGRAPH or "job_id" not in body:
+        return body.get("file_id")
+    # Indexing runs in the background; time until the document is ready
+    t0 = time.perf_counter()
+    while True:
+        job = (await client.get(f"/jobs/{body['job_id']}")).json()
+        if job["status"] in ("completed", "failed"):
+            recorder.add("ingest (time to ready)", time.perf_counter() - t0, ok=job["status"] == "completed")
+            return body["file_id"]
+        await asyncio.sleep(0.05)
+
+async def stream_turn(client, recorder, payload):
+    t0 = time.perf_counter()
+    first_token = None
+    ok = False
+    async with client.stream("POST", "/chat/stream", json=payload) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("event: token") and first_token is None:
+                first_token = time.perf_counter() - t0
+            elif line.startswith("event: done"):
+                ok = True
+            elif line.startswith("event: error"):
+                ok = False
+    recorder.add("/chat/stream", time.perf_counter() - t0, ok=ok)
+    if first_token is not None:
+        recorder.add("/chat/stream (first token)", first_token)
+
+async def run_session(client, recorder, service, session, limit):
+    async with limit:
+        for turn in session["turns"]:
+            payload = {"question": turn["question"], "session_id": session["session_id"]}
+            if turn["stream"] and service in LANGGRAPH:
+                await stream_turn(client, recorder, payload)
+            else:
+                await timed(recorder, "/chat", client.post("/chat", json=payload))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_service(service: str, args, workload: dict) -> dict:
+    import httpx
+    import uvicorn
+    import main  # the service, imported after the fakes are installed
+
+    docs_dir = tempfile.mkdtemp(prefix="bench-docs-")
+    for doc in workload["documents"]:
+        make_pdf(os.path.join(docs_dir, doc["name"]), doc["pages"], doc["seed"])
+
+    recorder = Recorder()
+    # A real server rather than httpx.ASGITransport, which only returns once
+    # the app has sent the whole body and so hides time to first token
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+            raise RuntimeError("uvicorn exited on start-up")
+        await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            file_ids = []
+            for doc in workload["documents"]:
+                file_ids.append(await upload(client, recorder, service, os.path.join(docs_dir, doc["name"]), doc["name"]))
+
+            limit = asyncio.Semaphore(args.concurrency)
+            chat_started = time.perf_counter()
+            await asyncio.gather(*(run_session(client, recorder, service, session, limit)
+                                   for session in workload["sessions"]))
+            chat_wall = time.perf_counter() - chat_started
+
+            for _ in range(args.list_calls):
+                await timed(recorder, "/list-docs", client.get("/list-docs"))
+            for file_id in file_ids:
+                if file_id is not None:
+                    await timed(recorder, "/delete-doc", client.post("/delete-doc", json={"file_id": file_id}))
+            cache_stats = (await client.get("/cache-stats")).json() if service in LANGGRAPH else None
+    finally:
+        server.should_exit = True
+        await serving
+
+    from fakes import CALLS
+    turns = sum(len(s["turns"]) for s in workload["sessions"])
+    return {
+        "wall_s": round(time.perf_counter() - started, 3),
+        "chat_wall_s": round(chat_wall, 3),
+        "chat_turns_per_s": round(turns / chat_wall, 3) if chat_wall else 0.0,
+        "endpoints": recorder.summary(),
+        "upstream_calls": dict(CALLS),
+        "upstream_calls_per_turn": {k: round(v / turns, 3) for k, v in CALLS.items()} if turns else {},
+        "cache_stats": cache_stats,
+    }
+
+def child(args):
+    """Entry point of the per-service subprocess."""
+    from fakes import Latency, install_fakes
+    install_fakes(Latency(**{f.name: getattr(args, f.name) for f in fields(Latency)}))
+    workdir = tempfile.mkdtemp(prefix=f"bench-{args.service}-")
+    os.chdir(workdir)
+    api_dir, env = SERVICES[args.service]
+    sys.path.insert(0, os.path.join(REPO, api_dir))
+    os.environ.update(env)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+    os.environ.setdefault("TAVILY_API_KEY", "tvly-offline")
+    result = asyncio.run(run_service(args.service, args, build_workload(args)))
+    with open(args.child_out, "w") as f:
+        json.dump(result, f)
+
+# ── Reports ──────────────────────────────────────────────────────────
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    if old["meta"]["workload"] != new["meta"]["workload"] or old["meta"]["latency"] != new["meta"]["latency"]:
+        print("warning: the two reports used different workloads or injected latency")
+    for service, result in new["services"].items():
+        before = old["services"].get(service)
+        if before is None:
+            continue
+        print(f"\n{service}  ({before['chat_turns_per_s']} -> {result['chat_turns_per_s']} turns/s)")
+        for endpoint, stats in result["endpoints"].items():
+            base = before["endpoints"].get(endpoint)
+            if base is None:
+                continue
+            deltas = "  ".join(
+                f"{key[:-3]} {base[key]:9.1f} -> {stats[key]:9.1f} ms ({(stats[key] - base[key]) / base[key] * 100 if base[key] else 0.0:+6.1f}%)"
+                for key in ("p50_ms", "p95_ms", "p99_ms"))
+            print(f"  {endpoint:<28} {deltas}")
+        for key, value in result["upstream_calls_per_turn"].items():
+            print(f"  {key + ' / turn':<28} {before['upstream_calls_per_turn'].get(key, 0):9.2f} -> {value:9.2f}")
+
+def planner_savings(report: dict) -> dict | None:
+    """What planner mode saved per /chat turn, when both LangGraph variants ran."""
+    two_call, planner = report["services"].get("langgraph"), report["services"].get("langgraph-planner")
+    if not two_call or not planner or "/chat" not in two_call["endpoints"] or "/chat" not in planner["endpoints"]:
+        return None
+    savings = {f"chat_{key}_saved": round(two_call["endpoints"]["/chat"][key] - planner["endpoints"]["/chat"][key], 2)
+               for key in ("p50_ms", "p95_ms", "p99_ms")}
+    for key in ("llm_calls", "llm_input_tokens", "llm_output_tokens"):
+        savings[f"{key}_saved_per_turn"] = round(two_call["upstream_calls_per_turn"].get(key, 0)
+                                                 - planner["upstream_calls_per_turn"].get(key, 0), 3)
+    return savings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="langgraph,rag-course",
+                        help=f"comma-separated services to run, from: {', '.join(SERVICES)}")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions running at the same time")
+    parser.add_argument("--doc-pages", default="2,10,40", help="page counts of the uploaded PDFs")
+    parser.add_argument("--docs-per-size", type=int, default=1)
+    parser.add_argument("--list-calls", type=int, default=20)
+    parser.add_argument("--stream-ratio", type=float, default=0.25, help="share of LangGraph turns sent to /chat/stream")
+    from fakes import Latency
+    for f in fields(Latency):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=float, default=f.default)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports and exit")
+    parser.add_argument("--service", choices=SERVICES, help=argparse.SUPPRESS)
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.child_out:
+        return child(args)
+
+    workload_args = {k: getattr(args, k) for k in ("seed", "sessions", "concurrency", "doc_pages",
+                                                    "docs_per_size", "list_calls", "stream_ratio")}
+    latency = {f.name: getattr(args, f.name) for f in fields(Latency)}
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "workload": workload_args, "latency": latency},
+        "services": {},
+    }
+    for service in args.services.split(","):
+        fd, out = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        cmd = [sys.executable, os.path.abspath(__file__), "--service", service, "--child-out", out,
+               *[f"--{k.replace('_', '-')}={v}" for k, v in {**workload_args, **latency}.items()]]
+        print(f"running {service} ...", flush=True)
+        subprocess.run(cmd, check=True)
+        with open(out) as f:
+            report["services"][service] = json.load(f)
+        os.remove(out)
+        for endpoint, stats in report["services"][service]["endpoints"].items():
+            print(f"  {endpoint:<28} n={stats['count']:<5} p50 {stats['p50_ms']:9.1f} ms  "
+                  f"p95 {stats['p95_ms']:9.1f} ms  p99 {stats['p99_ms']:9.1f} ms  errors {stats['errors']}")
+
+    savings = planner_savings(report)
+    if savings:
+        report["planner_savings"] = savings
+        print("planner mode vs two calls: " + "  ".join(f"{k} {v}" for k, v in savings.items()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
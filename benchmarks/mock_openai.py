@@ -0,0 +1,160 @@
+"""
+Local OpenAI-compatible server for exercising the services' HTTP clients.
+
+Serves `POST /v1/chat/completions` (plain and `stream: true`) and
+`POST /v1/embeddings` with HTTP/1.1 keep-alive. It counts TCP connections
+and the peak number of requests in flight, and can throttle: every
+`rate_limit_every`-th request gets a 429 with `Retry-After`. `GET /stats`
+returns the counters. Standard library only.
+
+    python benchmarks/mock_openai.py --port 8901 --latency-ms 200 --rate-limit-every 5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockState:
+    def __init__(self, latency_ms: float = 100.0, rate_limit_every: int = 0, retry_after: float = 0.2):
+        self.latency_ms = latency_ms
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0, "rate_limited": 0, "in_flight": 0,
+                      "peak_in_flight": {"chat": 0, "embeddings": 0}}
+        self._in_flight = {"chat": 0, "embeddings": 0}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            return self._send_json(200, self.state.snapshot())
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        kind = "embeddings" if self.path.endswith("/embeddings") else "chat"
+        state = self.state
+        with state.lock:
+            state.stats["requests"] += 1
+            number = state.stats["requests"]
+            throttle = state.rate_limit_every and number % state.rate_limit_every == 0
+            if throttle:
+                state.stats["rate_limited"] += 1
+        if throttle:
+            return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                   {"Retry-After": f"{state.retry_after:g}"})
+
+        with state.lock:
+            state._in_flight[kind] += 1
+            state.stats["in_flight"] += 1
+            peak = state.stats["peak_in_flight"]
+            peak[kind] = max(peak[kind], state._in_flight[kind])
+        try:
+            time.sleep(state.latency_ms / 1000)
+            if kind == "embeddings":
+                self._embeddings(body)
+            elif body.get("stream"):
+                self._chat_stream(body)
+            else:
+                self._chat(body)
+        finally:
+            with state.lock:
+                state._in_flight[kind] -= 1
+                state.stats["in_flight"] -= 1
+
+    # ── Responses ───────────────────────────────────────────────────
+    @staticmethod
+    def _reply(body: dict) -> str:
+        last = next((m.get("content") for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+        return f"Mock answer to: {str(last)[:80]}"
+
+    def _chat(self, body: dict):
+        reply = self._reply(body)
+        self._send_json(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": len(reply.split()),
+                      "total_tokens": 10 + len(reply.split())},
+        })
+
+    def _chat_stream(self, body: dict):
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "mock")}
+        events = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": word + " "},
+                                        "finish_reason": None}]}
+                  for word in self._reply(body).split()]
+        events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        data = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        payload = data.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or 8
+        self._send_json(200, {
+            "object": "list", "model": body.get("model", "mock"),
+            "data": [{"object": "embedding", "index": i,
+                      "embedding": [((hash(str(text)) >> d) % 100) / 100 for d in range(dimensions)]}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+def start_server(port: int = 0, **state_kwargs) -> tuple[ThreadingHTTPServer, MockState]:
+    """Start the server on a daemon thread; returns it and its state (port 0 picks a free port)."""
+    state = MockState(**state_kwargs)
+    handler = type("BoundHandler", (Handler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds sent with a 429")
+    args = parser.parse_args()
+    server, _ = start_server(args.port, latency_ms=args.latency_ms, rate_limit_every=args.rate_limit_every,
+                             retry_after=args.retry_after)
+    print(f"mock OpenAI API on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()